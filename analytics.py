@@ -0,0 +1,510 @@
+import hashlib
+import json
+import os
+import struct
+import time
+import zlib
+
+import numpy as np
+
+import storage
+
+# Rows fetched (and held as arrays) at a time; memory use is bounded by this
+# plus the per-user and per-question totals, not by the table size
+CHUNK_ROWS = int(os.getenv("QUIZ_ANALYTICS_CHUNK_ROWS", "100000"))
+# Questions need this many answers before they are ranked
+MIN_ANSWERS = 20
+# Share of users in each of the upper and lower groups of the discrimination index
+GROUP_FRACTION = 0.27
+
+ARCHIVE_MAGIC = b"QZRA2\n"
+# Version 1 archives stored the day instead of created_at and no answers
+_ARCHIVE_MAGIC_V1 = b"QZRA1\n"
+# Archive column dtypes; is_correct is bit-packed after them. created_at is
+# -1 for answers saved without an attempt, as are their score and total.
+DTYPES = {"user": np.int32, "question": np.int32, "level": np.int8, "day": np.int32, "created_at": np.float64,
+          "attempt": np.int64, "user_answer": np.int32, "correct_answer": np.int32, "score": np.int16,
+          "total": np.int16}
+# What the reports read, and what an archive needs for import_results
+REPORT_COLUMNS = ("user", "question", "level", "created_at", "attempt")
+FULL_COLUMNS = REPORT_COLUMNS + ("user_answer", "correct_answer", "score", "total")
+_V1_COLUMNS = ("user", "question", "level", "day", "attempt")
+_SECONDS_PER_DAY = 86400
+
+
+class Encoder:
+    """Dictionary-encodes usernames, question texts, levels and answers as dense int codes.
+
+    Codes are stable for the life of the encoder, so repeated scans (and
+    archives written from them) agree on which code means which string.
+    """
+
+    def __init__(self, users=(), questions=(), levels=(), answers=()):
+        self.users = {name: code for code, name in enumerate(users)}
+        self.questions = {text: code for code, text in enumerate(questions)}
+        self.levels = {level: code for code, level in enumerate(levels)}
+        self.answers = {text: code for code, text in enumerate(answers)}
+
+    @staticmethod
+    def _encode(index, values, dtype):
+        setdefault = index.setdefault
+        return np.fromiter((setdefault(value, len(index)) for value in values), dtype=dtype, count=len(values))
+
+    # Rows are (user, question, level, created_at, attempt, is_correct),
+    # optionally followed by (user_answer, correct_answer, score, total)
+    def encode(self, rows):
+        columns = list(zip(*rows))
+        users, questions, levels, created, attempts, correct = columns[:6]
+        created = np.array(created, dtype=np.float64)
+        chunk = {
+            "user": self._encode(self.users, users, np.int32),
+            "question": self._encode(self.questions, questions, np.int32),
+            "level": self._encode(self.levels, levels, np.int8),
+            "created_at": created,
+            "day": _days(created),
+            "attempt": np.array(attempts, dtype=np.int64),
+            "correct": np.array(correct, dtype=np.bool_),
+        }
+        if len(columns) > 6:
+            user_answers, correct_answers, scores, totals = columns[6:]
+            chunk["user_answer"] = self._encode(self.answers, user_answers, np.int32)
+            chunk["correct_answer"] = self._encode(self.answers, correct_answers, np.int32)
+            chunk["score"] = np.array(scores, dtype=np.int16)
+            chunk["total"] = np.array(totals, dtype=np.int16)
+        return chunk
+
+    def names(self, kind):
+        index = getattr(self, kind)
+        names = [None] * len(index)
+        for name, code in index.items():
+            names[code] = name
+        return names
+
+
+def _days(created):
+    days = np.floor_divide(created, _SECONDS_PER_DAY).astype(np.int32)
+    days[created < 0] = -1
+    return days
+
+
+class DatabaseResults:
+    """quiz_results joined to quiz_attempts, streamed in chunks of columnar arrays.
+
+    Answers saved without an attempt get level "unknown", created_at, day and
+    attempt -1. With `full`, chunks also carry the answers and the attempt's
+    score and total (what import_results needs); reports don't read them.
+    """
+
+    def __init__(self, pool=None, chunk_rows=CHUNK_ROWS, encoder=None, full=False):
+        self.pool = pool
+        self.chunk_rows = chunk_rows
+        self.encoder = encoder or Encoder()
+        self.columns = FULL_COLUMNS if full else REPORT_COLUMNS
+
+    def chunks(self):
+        if self.pool is None:
+            storage.init_db()
+        extra = (", r.user_answer, r.correct_answer, COALESCE(a.score, -1), COALESCE(a.total, -1)"
+                 if self.columns == FULL_COLUMNS else "")
+        with (self.pool or storage.get_pool()).connection() as conn:
+            cursor = conn.execute(f'''SELECT r.username, r.question, COALESCE(a.level, ?),
+                                             COALESCE(a.created_at, -1), COALESCE(r.attempt_id, -1),
+                                             r.is_correct{extra}
+                                      FROM quiz_results r LEFT JOIN quiz_attempts a ON a.id = r.attempt_id
+                                      ORDER BY r.id''', (storage.UNKNOWN_LEVEL,))
+            while True:
+                rows = cursor.fetchmany(self.chunk_rows)
+                if not rows:
+                    break
+                yield self.encoder.encode(rows)
+
+
+def _write_block(out, data):
+    out.write(struct.pack("<I", len(data)))
+    out.write(data)
+
+
+def _read_block(source):
+    (size,) = struct.unpack("<I", source.read(4))
+    return source.read(size)
+
+
+# Write chunks to a compact columnar archive: one zlib-compressed block per
+# column per row group, then the column list and string dictionaries as a
+# JSON footer whose offset is stored in the last 8 bytes (so writing never
+# needs a second pass). By default every column is written, so the archive
+# can be loaded back with import_results.
+def export_results(path, results=None, level=1):
+    results = results or DatabaseResults(full=True)
+    rows = 0
+    with open(path, "wb") as out:
+        out.write(ARCHIVE_MAGIC)
+        for chunk in results.chunks():
+            count = len(chunk["user"])
+            out.write(struct.pack("<I", count))
+            for name in results.columns:
+                _write_block(out, zlib.compress(chunk[name].astype(DTYPES[name], copy=False).tobytes(), level))
+            _write_block(out, zlib.compress(np.packbits(chunk["correct"]).tobytes(), level))
+            rows += count
+        footer_offset = out.tell()
+        out.write(struct.pack("<I", 0))
+        encoder = results.encoder
+        footer = {kind: encoder.names(kind) for kind in ("users", "questions", "levels", "answers")}
+        footer["columns"] = list(results.columns)
+        _write_block(out, zlib.compress(json.dumps(footer).encode("utf-8"), level))
+        out.write(struct.pack("<Q", footer_offset))
+    return rows
+
+
+class ArchiveResults:
+    """Chunks read back from an archive written by export_results."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as source:
+            magic = source.read(len(ARCHIVE_MAGIC))
+            if magic not in (ARCHIVE_MAGIC, _ARCHIVE_MAGIC_V1):
+                raise ValueError(f"{path} is not a quiz results archive")
+            source.seek(-8, os.SEEK_END)
+            (footer_offset,) = struct.unpack("<Q", source.read(8))
+            source.seek(footer_offset + 4)
+            footer = json.loads(zlib.decompress(_read_block(source)))
+        self.columns = tuple(footer.get("columns", _V1_COLUMNS))
+        self.encoder = Encoder(footer["users"], footer["questions"], footer["levels"], footer.get("answers", ()))
+
+    def chunks(self):
+        with open(self.path, "rb") as source:
+            source.seek(len(ARCHIVE_MAGIC))
+            while True:
+                (count,) = struct.unpack("<I", source.read(4))
+                if count == 0:
+                    break
+                chunk = {name: np.frombuffer(zlib.decompress(_read_block(source)), dtype=DTYPES[name])
+                         for name in self.columns}
+                packed = np.frombuffer(zlib.decompress(_read_block(source)), dtype=np.uint8)
+                chunk["correct"] = np.unpackbits(packed, count=count).astype(np.bool_)
+                if "day" not in chunk:
+                    chunk["day"] = _days(chunk["created_at"])
+                yield chunk
+
+
+# Load an archive written by export_results into the database, e.g. to move
+# results between deployments or restore a pruned table. Attempts get new
+# ids but keep their archived score, total and time. The whole archive is
+# loaded in one transaction, and an archive whose contents were imported
+# before (identified by their SHA-256) is refused with ValueError; archives
+# exported at different times can still overlap, which is not detected.
+def import_results(path):
+    archive = ArchiveResults(path)
+    if not set(FULL_COLUMNS) <= set(archive.columns):
+        raise ValueError(f"{path} holds no answers; only archives from export_results can be imported")
+    digest = hashlib.sha256()
+    with open(path, "rb") as source:
+        for block in iter(lambda: source.read(1 << 20), b""):
+            digest.update(block)
+    storage.init_db()
+    return storage.import_quiz_results(digest.hexdigest(), _import_batches(archive))
+
+
+# (attempts, answers) per chunk of `archive`, as storage.import_quiz_results takes them
+def _import_batches(archive):
+    names = {kind: np.array(archive.encoder.names(kind), dtype=object)
+             for kind in ("users", "questions", "levels", "answers")}
+    # An attempt's answers are stored together; the open one is carried
+    # across chunk boundaries and emitted with the chunk that ends it
+    current = None
+    for chunk in archive.chunks():
+        attempts, answers = [], []
+        rows = zip(names["users"][chunk["user"]], names["questions"][chunk["question"]],
+                   names["levels"][chunk["level"]], chunk["created_at"].tolist(), chunk["attempt"].tolist(),
+                   names["answers"][chunk["user_answer"]], names["answers"][chunk["correct_answer"]],
+                   chunk["correct"].tolist(), chunk["score"].tolist(), chunk["total"].tolist())
+        for user, question, level, created_at, attempt, user_answer, correct_answer, is_correct, score, total in rows:
+            result = (question, user_answer, correct_answer, is_correct)
+            if attempt < 0:
+                answers.append((user,) + result)
+                continue
+            if current is None or current[0] != attempt:
+                if current is not None:
+                    attempts.append(current[1:])
+                current = (attempt, user, level, [], created_at, score, total)
+            current[3].append(result)
+        yield attempts, answers
+    if current is not None:
+        yield [current[1:]], []
+
+
+def _grow(totals, size):
+    # Dictionaries grow while streaming, so per-code totals grow with them
+    if len(totals) < size:
+        totals = np.concatenate([totals, np.zeros(size - len(totals), dtype=totals.dtype)])
+    return totals
+
+
+def _add(totals, codes, size=0):
+    counts = np.bincount(codes, minlength=size)
+    totals = _grow(totals, len(counts))
+    totals[:len(counts)] += counts
+    return totals
+
+
+# Cohort statistics over every answer in `results` (DatabaseResults or
+# ArchiveResults), in two streaming passes:
+#   1. answered/correct per level, per day, per question and per user,
+#      plus attempts per day;
+#   2. per-question accuracy within the upper and lower GROUP_FRACTION of
+#      users by overall accuracy. The discrimination index is the
+#      difference; near zero or negative means the question does not
+#      separate strong from weak users (often a wrong answer key).
+# The database is scanned once into a temporary archive that both passes
+# read, since decoding SQLite rows costs far more than the statistics.
+def cohort_report(results=None, top=10, min_answers=MIN_ANSWERS):
+    results = results or DatabaseResults()
+    if isinstance(results, DatabaseResults):
+        import tempfile
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            spool = os.path.join(tmpdir, "results.qzr")
+            export_results(spool, results)
+            return cohort_report(ArchiveResults(spool), top, min_answers)
+    empty = np.zeros(0, dtype=np.int64)
+    level_answered = level_correct = question_answered = question_correct = empty
+    user_answered = user_correct = empty
+    days = {}
+    rows = 0
+    last_attempt = -1
+    for chunk in results.chunks():
+        rows += len(chunk["user"])
+        correct = chunk["correct"]
+        level_answered = _add(level_answered, chunk["level"])
+        level_correct = _add(level_correct, chunk["level"][correct], len(level_answered))
+        question_answered = _add(question_answered, chunk["question"])
+        question_correct = _add(question_correct, chunk["question"][correct], len(question_answered))
+        user_answered = _add(user_answered, chunk["user"])
+        user_correct = _add(user_correct, chunk["user"][correct], len(user_answered))
+
+        # An attempt's answers are stored together, so each change of attempt
+        # id (carried across chunk boundaries) starts a new attempt
+        attempt = chunk["attempt"]
+        starts = np.empty(len(attempt), dtype=np.bool_)
+        starts[0] = attempt[0] != last_attempt
+        starts[1:] = attempt[1:] != attempt[:-1]
+        starts &= attempt >= 0
+        last_attempt = attempt[-1]
+        day_values, inverse = np.unique(chunk["day"], return_inverse=True)
+        answered = np.bincount(inverse, minlength=len(day_values))
+        right = np.bincount(inverse[correct], minlength=len(day_values))
+        attempts = np.bincount(inverse[starts], minlength=len(day_values))
+        for day, day_answered, day_correct, day_attempts in zip(
+                day_values.tolist(), answered.tolist(), right.tolist(), attempts.tolist()):
+            totals = days.setdefault(day, [0, 0, 0])
+            totals[0] += day_answered
+            totals[1] += day_correct
+            totals[2] += day_attempts
+
+    group = _user_groups(user_answered, user_correct, min_answers)
+    upper_answered = upper_correct = lower_answered = lower_correct = empty
+    size = len(question_answered)
+    if group is not None:
+        for chunk in results.chunks():
+            membership = group[chunk["user"]]
+            upper, lower = membership == 1, membership == -1
+            question, correct = chunk["question"], chunk["correct"]
+            upper_answered = _add(upper_answered, question[upper], size)
+            upper_correct = _add(upper_correct, question[upper & correct], size)
+            lower_answered = _add(lower_answered, question[lower], size)
+            lower_correct = _add(lower_correct, question[lower & correct], size)
+
+    levels = results.encoder.names("levels")
+    questions = results.encoder.names("questions")
+    report = {
+        "rows": rows,
+        "users": len(user_answered),
+        "questions": size,
+        "by_level": [(levels[code], int(answered), int(level_correct[code]), float(level_correct[code] / answered))
+                     for code, answered in enumerate(level_answered) if answered],
+        "by_day": [(_day_label(day), answered, correct, attempts)
+                   for day, (answered, correct, attempts) in sorted(days.items())],
+        "hardest": [],
+        "discrimination": [],
+    }
+    eligible = np.flatnonzero(question_answered >= min_answers)
+    if len(eligible):
+        accuracy = question_correct[eligible] / question_answered[eligible]
+        for position in np.argsort(accuracy, kind="stable")[:top]:
+            code = eligible[position]
+            report["hardest"].append((questions[code], int(question_answered[code]), float(accuracy[position])))
+    if group is not None:
+        # Each group needs a few answers for its accuracy to mean anything
+        needed = max(1, int(min_answers * GROUP_FRACTION))
+        ranked = np.flatnonzero((upper_answered >= needed) & (lower_answered >= needed))
+        if len(ranked):
+            index = (upper_correct[ranked] / upper_answered[ranked]
+                     - lower_correct[ranked] / lower_answered[ranked])
+            report["median_discrimination"] = float(np.median(index))
+            for position in np.argsort(index, kind="stable")[:top]:
+                code = ranked[position]
+                report["discrimination"].append((questions[code], int(question_answered[code]),
+                                                 float(index[position])))
+    return report
+
+
+# +1 for the upper group, -1 for the lower group, 0 otherwise (including
+# users with fewer than `min_answers` answers); None if there are too few users
+def _user_groups(user_answered, user_correct, min_answers):
+    eligible = np.flatnonzero(user_answered >= min_answers)
+    group_size = int(len(eligible) * GROUP_FRACTION)
+    if group_size == 0:
+        return None
+    order = eligible[np.argsort(user_correct[eligible] / user_answered[eligible], kind="stable")]
+    group = np.zeros(len(user_answered), dtype=np.int8)
+    group[order[:group_size]] = -1
+    group[order[-group_size:]] = 1
+    return group
+
+
+def _day_label(day):
+    return "unknown" if day < 0 else time.strftime("%Y-%m-%d", time.gmtime(day * _SECONDS_PER_DAY))
+
+
+def _peak_rss_mb():
+    import resource
+
+    # ru_maxrss is KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+# Fill a scratch database with `rows` answers: `users` users taking 5-question
+# attempts drawn from `questions` questions whose difficulty varies, over 90 days
+def _populate(rows, users, questions, seed=0, batch=50000):
+    rng = np.random.default_rng(seed)
+    difficulty = rng.uniform(0.2, 0.95, questions)
+    ability = rng.normal(0.0, 0.15, users)
+    levels = np.array(["easy", "medium", "hard"])
+    start_day = int(time.time()) // _SECONDS_PER_DAY - 90
+    per_attempt = 5
+    attempt_id = 0
+    storage.init_db()
+    for offset in range(0, rows, batch):
+        count = min(batch, rows - offset) // per_attempt
+        ids = np.arange(attempt_id + 1, attempt_id + count + 1)
+        attempt_users = rng.integers(0, users, count)
+        attempt_levels = levels[rng.integers(0, 3, count)]
+        created = (start_day + rng.integers(0, 90, count)) * _SECONDS_PER_DAY + rng.integers(0, 86400, count)
+        answer_users = np.repeat(attempt_users, per_attempt)
+        answer_questions = rng.integers(0, questions, count * per_attempt)
+        odds = np.clip(difficulty[answer_questions] + ability[answer_users], 0.02, 0.98)
+        correct = rng.random(count * per_attempt) < odds
+        scores = correct.reshape(count, per_attempt).sum(axis=1)
+        # One transaction per batch keeps the WAL file from growing to the size of the table
+        with storage.get_pool().transaction() as conn:
+            conn.executemany('''INSERT INTO quiz_attempts (id, username, level, score, total, created_at)
+                                VALUES (?, ?, ?, ?, ?, ?)''',
+                             zip(ids.tolist(), (f"user{u}" for u in attempt_users.tolist()),
+                                 attempt_levels.tolist(), scores.tolist(), [per_attempt] * count,
+                                 created.tolist()))
+            conn.executemany('''INSERT INTO quiz_results
+                                  (username, question, user_answer, correct_answer, is_correct, attempt_id)
+                                VALUES (?, ?, ?, ?, ?, ?)''',
+                             zip((f"user{u}" for u in answer_users.tolist()),
+                                 (f"Question {q}?" for q in answer_questions.tolist()),
+                                 ("b" if c else "a" for c in correct.tolist()), ["b"] * len(correct),
+                                 correct.tolist(), np.repeat(ids, per_attempt).tolist()))
+        attempt_id += count
+
+
+# Python-loop baseline: what a report over fetchall() costs (level accuracy only)
+def _naive_level_accuracy():
+    with storage.get_pool().connection() as conn:
+        rows = conn.execute('''SELECT COALESCE(a.level, ?), r.is_correct FROM quiz_results r
+                               LEFT JOIN quiz_attempts a ON a.id = r.attempt_id''',
+                            (storage.UNKNOWN_LEVEL,)).fetchall()
+    totals = {}
+    for level, is_correct in rows:
+        entry = totals.setdefault(level, [0, 0])
+        entry[0] += 1
+        entry[1] += is_correct
+    return totals
+
+
+# Benchmark: report over `rows` synthetic answers from SQLite, export them to
+# an archive, and report again from the archive. Peak RSS is sampled after
+# each step; it should stay flat as `rows` grows.
+def benchmark(rows=10_000_000, users=20000, questions=50000, baseline=False, path=None):
+    import tempfile
+
+    tmpdir = tempfile.TemporaryDirectory()
+    path = path or os.path.join(tmpdir.name, "analytics.db")
+    result = {"rows": rows}
+    try:
+        with storage.temporary_pool(path):
+            start = time.perf_counter()
+            _populate(rows, users, questions)
+            result["populate_seconds"] = time.perf_counter() - start
+            result["rss_after_populate_mb"] = _peak_rss_mb()
+
+            start = time.perf_counter()
+            report = cohort_report(DatabaseResults())
+            result["db_report_seconds"] = time.perf_counter() - start
+            result["rss_after_db_report_mb"] = _peak_rss_mb()
+
+            archive = os.path.join(tmpdir.name, "results.qzr")
+            start = time.perf_counter()
+            export_results(archive)
+            result["export_seconds"] = time.perf_counter() - start
+            result["archive_mb"] = os.path.getsize(archive) / 1e6
+            result["db_mb"] = os.path.getsize(path) / 1e6
+
+            start = time.perf_counter()
+            archived = cohort_report(ArchiveResults(archive))
+            result["archive_report_seconds"] = time.perf_counter() - start
+            result["rss_after_archive_report_mb"] = _peak_rss_mb()
+            result["reports_match"] = archived["by_level"] == report["by_level"] and \
+                archived["discrimination"] == report["discrimination"]
+
+            if baseline:
+                start = time.perf_counter()
+                _naive_level_accuracy()
+                result["naive_level_seconds"] = time.perf_counter() - start
+                result["rss_after_naive_mb"] = _peak_rss_mb()
+            result["report"] = report
+    finally:
+        tmpdir.cleanup()
+    return result
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Cohort statistics over quiz results")
+    parser.add_argument("--export", metavar="PATH", help="write every answer to a compact archive")
+    parser.add_argument("--archive", metavar="PATH", help="report from an archive instead of the database")
+    parser.add_argument("--import", dest="import_path", metavar="PATH",
+                        help="load an archive written by --export into the database")
+    parser.add_argument("--benchmark", type=int, metavar="ROWS", help="benchmark on ROWS synthetic answers")
+    parser.add_argument("--baseline", action="store_true", help="also time a fetchall() loop (benchmark only)")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        result = benchmark(args.benchmark, baseline=args.baseline)
+        report = result.pop("report")
+        for key, value in result.items():
+            print(f"{key}: {value:.2f}" if isinstance(value, float) else f"{key}: {value}")
+        print("median discrimination:", round(report.get("median_discrimination", float("nan")), 3))
+    elif args.export:
+        print(f"exported {export_results(args.export)} answers to {args.export}")
+    elif args.import_path:
+        print(f"imported {import_results(args.import_path)} answers from {args.import_path}")
+    else:
+        report = cohort_report(ArchiveResults(args.archive) if args.archive else DatabaseResults())
+        print(f"{report['rows']} answers from {report['users']} users on {report['questions']} questions")
+        for level, answered, correct, accuracy in report["by_level"]:
+            print(f"  {level:<8} {answered:>10} answered {accuracy:6.1%}")
+        for day, answered, correct, attempts in report["by_day"][-14:]:
+            print(f"  {day} {attempts:>8} attempts {answered:>10} answered")
+        print("hardest questions:")
+        for question, answered, accuracy in report["hardest"]:
+            print(f"  {accuracy:6.1%} of {answered:>6}  {question[:70]}")
+        print("least discriminating questions:")
+        for question, answered, index in report["discrimination"]:
+            print(f"  D={index:+.2f} of {answered:>6}  {question[:70]}")
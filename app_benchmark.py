@@ -0,0 +1,96 @@
+import os
+import tempfile
+import time
+
+from streamlit.testing.v1 import AppTest
+
+import auth
+import generation
+from backends import FakeBackend
+import storage
+
+SAMPLE_TEXT = ("The mitochondrion is an organelle found in most eukaryotic cells. It generates most of "
+               "the cell's supply of adenosine triphosphate, which is used as a source of chemical energy.")
+
+
+class Counters:
+    """Counts script runs, pooled DB checkouts and backend calls between snapshots.
+
+    Wraps storage.init_db until `restore` is called.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.runs = 0
+        self._init_db = init_db = storage.init_db
+
+        # main() calls init_db() exactly once per script run
+        def counting_init_db():
+            self.runs += 1
+            init_db()
+
+        storage.init_db = counting_init_db
+
+    def snapshot(self):
+        return self.runs, storage.get_pool().checkouts, self.backend.calls
+
+    def restore(self):
+        storage.init_db = self._init_db
+
+
+def _click(at, label):
+    next(button for button in at.button if button.label == label).click()
+
+
+# Drive one user through login -> generate -> answer every question -> submit
+# and record reruns, DB calls and LLM calls for each step.
+def benchmark(latency=0.2):
+    tmpdir = tempfile.TemporaryDirectory()
+    previous_service = generation._service
+    counters = None
+    try:
+        with storage.temporary_pool(os.path.join(tmpdir.name, "app_bench.db")):
+            storage.init_db()
+            auth.signup("bench", "bench-password")
+            backend = FakeBackend(latency=latency, jitter=0.0, seed=0)
+            generation._service = generation.GenerationService(backend, rate=100, burst=10)
+            counters = Counters(backend)
+
+            at = AppTest.from_file(os.path.join(os.path.dirname(os.path.abspath(__file__)), "quizapp.py"),
+                                   default_timeout=60)
+            steps = []
+
+            def step(name, action):
+                before = counters.snapshot()
+                start = time.perf_counter()
+                action()
+                at.run()
+                elapsed = time.perf_counter() - start
+                after = counters.snapshot()
+                steps.append((name, after[0] - before[0], after[1] - before[1], after[2] - before[2], elapsed))
+
+            step("open", lambda: None)
+            step("login", lambda: (at.text_input[0].input("bench"), at.text_input[1].input("bench-password"),
+                                   _click(at, "Login")))
+            step("generate", lambda: (at.text_area[0].input(SAMPLE_TEXT), _click(at, "Generate Quiz")))
+            for index in range(len(at.radio)):
+                step(f"answer {index + 1}",
+                     lambda index=index: at.radio[index].set_value(at.radio[index].options[0]))
+            step("submit", lambda: _click(at, "Submit"))
+    finally:
+        if counters is not None:
+            counters.restore()
+        generation._service = previous_service
+        tmpdir.cleanup()
+    return steps, at.exception
+
+
+if __name__ == "__main__":
+    steps, exceptions = benchmark()
+    print(f"{'step':<10} {'reruns':>6} {'db':>4} {'llm':>4} {'seconds':>8}")
+    for name, reruns, db_calls, llm_calls, elapsed in steps:
+        print(f"{name:<10} {reruns:>6} {db_calls:>4} {llm_calls:>4} {elapsed:>8.3f}")
+    totals = [sum(step[i] for step in steps) for i in (1, 2, 3)]
+    print(f"{'total':<10} {totals[0]:>6} {totals[1]:>4} {totals[2]:>4}")
+    if exceptions:
+        print("app raised:", [exception.value for exception in exceptions])
@@ -0,0 +1,174 @@
+import base64
+import hashlib
+import hmac
+import os
+import secrets
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from storage import create_user, fetch_password_hash, update_password_hash
+
+# scrypt cost: N=2**14, r=8 needs 16 MiB per hash. Raise N on faster hardware.
+SCRYPT_N = int(os.getenv("QUIZ_SCRYPT_N", str(2 ** 14)))
+SCRYPT_R = int(os.getenv("QUIZ_SCRYPT_R", "8"))
+SCRYPT_P = int(os.getenv("QUIZ_SCRYPT_P", "1"))
+# Concurrent hashes are capped so a burst of logins cannot exhaust memory or
+# starve the other sessions' script threads
+HASH_WORKERS = int(os.getenv("QUIZ_HASH_WORKERS", "2"))
+SESSION_TTL = int(os.getenv("QUIZ_SESSION_TTL", str(12 * 3600)))
+# Without a configured secret, tokens are only valid for this process
+SESSION_SECRET = os.getenv("QUIZ_SESSION_SECRET", "").encode("utf-8") or secrets.token_bytes(32)
+
+_PREFIX = "scrypt"
+_hash_pool = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix="password-hash")
+
+
+def _b64(data):
+    return base64.urlsafe_b64encode(data).decode("ascii").rstrip("=")
+
+
+def _unb64(text):
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def _scrypt(password, salt, n, r, p):
+    return hashlib.scrypt(password.encode("utf-8"), salt=salt, n=n, r=r, p=p,
+                          maxmem=2 * 128 * n * r * p + 1024 * 1024, dklen=32)
+
+
+# Encode as scrypt$N$r$p$salt$hash so cost changes only affect new hashes
+def hash_password(password, n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P):
+    salt = secrets.token_bytes(16)
+    return "$".join([_PREFIX, str(n), str(r), str(p), _b64(salt), _b64(_scrypt(password, salt, n, r, p))])
+
+
+# Returns (matches, needs_rehash). Rows from before hashing hold the plaintext
+# password; they match by constant-time comparison and are flagged for rehash.
+# A malformed scrypt value (wrong field count, bad number, base64 or cost
+# parameters) never matches.
+def verify_password(password, stored):
+    if not stored.startswith(_PREFIX + "$"):
+        return hmac.compare_digest(password.encode("utf-8"), stored.encode("utf-8")), True
+    try:
+        _, n, r, p, salt, digest = stored.split("$")
+        n, r, p = int(n), int(r), int(p)
+        matches = hmac.compare_digest(_scrypt(password, _unb64(salt), n, r, p), _unb64(digest))
+    except (ValueError, OverflowError):
+        return False, False
+    return matches, (n, r, p) != (SCRYPT_N, SCRYPT_R, SCRYPT_P)
+
+
+# Hashed once so unknown usernames cost the same as wrong passwords
+_DUMMY_HASH = hash_password(secrets.token_hex(8))
+
+
+# User authentication
+def authenticate(username, password):
+    stored = fetch_password_hash(username)
+    # An empty stored password is a legacy plaintext row, not a missing user
+    checked = stored if stored is not None else _DUMMY_HASH
+    matches, needs_rehash = _hash_pool.submit(verify_password, password, checked).result()
+    if stored is None or not matches:
+        return False
+    if needs_rehash:
+        update_password_hash(username, _hash_pool.submit(hash_password, password).result())
+    return True
+
+
+# User signup
+def signup(username, password):
+    if fetch_password_hash(username) is not None:
+        return False
+    return create_user(username, _hash_pool.submit(hash_password, password).result())
+
+
+# Signed "username|expiry" token that lets reruns (and page reloads carrying
+# it) trust the login without touching the database
+def issue_token(username, ttl=SESSION_TTL):
+    payload = _b64(f"{username}|{int(time.time()) + ttl}".encode("utf-8"))
+    signature = _b64(hmac.new(SESSION_SECRET, payload.encode("ascii"), hashlib.sha256).digest())
+    return f"{payload}.{signature}"
+
+
+# Username for a valid, unexpired token, otherwise None
+def verify_token(token):
+    if not token or "." not in token:
+        return None
+    payload, signature = token.rsplit(".", 1)
+    expected = _b64(hmac.new(SESSION_SECRET, payload.encode("ascii"), hashlib.sha256).digest())
+    if not hmac.compare_digest(signature, expected):
+        return None
+    try:
+        username, expires = _unb64(payload).decode("utf-8").rsplit("|", 1)
+    except (ValueError, UnicodeDecodeError):
+        return None
+    if int(expires) < time.time():
+        return None
+    return username
+
+
+# Benchmark: `users` concurrent sessions logging in repeatedly at the
+# configured scrypt cost; reports logins/sec and latency percentiles.
+def benchmark(users=8, logins=20, path=None):
+    import tempfile
+    import threading
+
+    import storage
+
+    tmpdir = None
+    if path is None:
+        tmpdir = tempfile.TemporaryDirectory()
+        path = os.path.join(tmpdir.name, "auth_bench.db")
+    with storage.temporary_pool(path, size=max(users, 1)):
+        storage.init_db()
+        for n in range(users):
+            signup(f"user{n}", "correct horse battery staple")
+
+        latencies = []
+        lock = threading.Lock()
+
+        def session(n):
+            local = []
+            for _ in range(logins):
+                start = time.perf_counter()
+                authenticate(f"user{n}", "correct horse battery staple")
+                local.append(time.perf_counter() - start)
+            with lock:
+                latencies.extend(local)
+
+        threads = [threading.Thread(target=session, args=(n,)) for n in range(users)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wall = time.perf_counter() - start
+
+        token = issue_token("user0")
+        token_start = time.perf_counter()
+        for _ in range(10000):
+            verify_token(token)
+        token_us = (time.perf_counter() - token_start) / 10000 * 1e6
+
+    if tmpdir is not None:
+        tmpdir.cleanup()
+    latencies.sort()
+    return {
+        "logins_per_second": len(latencies) / wall,
+        "p50": latencies[len(latencies) // 2],
+        "p99": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))],
+        "token_us": token_us,
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark password hashing and login throughput")
+    parser.add_argument("--users", type=int, default=8)
+    parser.add_argument("--logins", type=int, default=20, help="logins per user")
+    args = parser.parse_args()
+    result = benchmark(args.users, args.logins)
+    print(f"scrypt N={SCRYPT_N} r={SCRYPT_R} p={SCRYPT_P} workers={HASH_WORKERS}: "
+          f"{result['logins_per_second']:.1f} logins/s p50={result['p50'] * 1000:.0f}ms "
+          f"p99={result['p99'] * 1000:.0f}ms; token check {result['token_us']:.1f}us")
@@ -0,0 +1,187 @@
+import asyncio
+import hashlib
+import json
+import math
+import os
+import random
+import re
+
+import metrics
+import prompts
+
+# "gemini" or "fake" (offline stand-in, configured by the QUIZ_FAKE_* variables)
+MODEL_BACKEND = os.getenv("QUIZ_MODEL_BACKEND", "gemini")
+
+
+class ModelBackend:
+    """Interface the generation service expects from a model backend.
+
+    `generate` returns the complete response text for a prompt and `stream`
+    yields it in chunks; both raise TransientBackendError (or an error named in
+    RETRYABLE_ERRORS) for failures worth retrying. `model_name` is part of the
+    quiz cache key.
+    """
+
+    model_name = None
+
+    async def generate(self, prompt):
+        raise NotImplementedError
+
+    async def stream(self, prompt):
+        raise NotImplementedError
+        yield
+
+
+class TransientBackendError(Exception):
+    """Raised by a backend for failures worth retrying (quota, overload, timeouts)."""
+
+
+# google.api_core exception names that mean "try again later"
+RETRYABLE_ERRORS = {"ResourceExhausted", "TooManyRequests", "ServiceUnavailable", "DeadlineExceeded",
+                    "InternalServerError"}
+
+
+def is_retryable(exc):
+    return isinstance(exc, TransientBackendError) or type(exc).__name__ in RETRYABLE_ERRORS
+
+
+class GeminiBackend(ModelBackend):
+    """Calls Gemini through google.generativeai; the model is built once per backend.
+
+    The static instructions travel as the model's system instruction. They are
+    far below the API's minimum size for cached content, so there is nothing
+    to gain from context caching.
+    """
+
+    def __init__(self, model_name=prompts.MODEL_NAME, api_key=None):
+        import google.generativeai as genai
+
+        genai.configure(api_key=api_key or os.getenv("GEMINI_API_KEY"))
+        self.model_name = model_name
+        self.model = genai.GenerativeModel(
+            model_name=model_name,
+            generation_config=prompts.GENERATION_CONFIG,
+            system_instruction=prompts.SYSTEM_INSTRUCTION,
+        )
+
+    async def generate(self, prompt):
+        response = await self.model.generate_content_async(prompt)
+        self._record_usage(response)
+        return response.text
+
+    async def stream(self, prompt):
+        response = await self.model.generate_content_async(prompt, stream=True)
+        async for chunk in response:
+            yield chunk.text
+        # Usage is reported on the final chunk of a stream
+        self._record_usage(response)
+
+    def _record_usage(self, response):
+        usage = getattr(response, "usage_metadata", None)
+        if usage is not None:
+            metrics.record_tokens(self.model_name, getattr(usage, "prompt_token_count", 0),
+                                  getattr(usage, "candidates_token_count", 0))
+
+
+# Latency distributions for FakeBackend: (mean or median, spread) -> seconds
+LATENCY_DISTRIBUTIONS = {
+    "constant": lambda rng, latency, jitter: latency,
+    "normal": lambda rng, latency, jitter: rng.gauss(latency, jitter),
+    "uniform": lambda rng, latency, jitter: rng.uniform(latency - jitter, latency + jitter),
+    "lognormal": lambda rng, latency, jitter: rng.lognormvariate(math.log(latency), jitter),
+    "exponential": lambda rng, latency, jitter: rng.expovariate(1 / latency),
+}
+
+_COUNT = re.compile(r"Create (\d+) multiple choice questions")
+
+
+class FakeBackend(ModelBackend):
+    """Deterministic offline stand-in for Gemini.
+
+    Each call draws its latency from `distribution` and fails with
+    `failure_rate` (retryable) or returns unparseable JSON with
+    `malformed_rate`. Randomness is seeded per prompt and attempt, so a run's
+    outcomes do not depend on how concurrent calls are scheduled.
+    """
+
+    model_name = "fake"
+
+    def __init__(self, latency=0.5, jitter=0.2, failure_rate=0.0, seed=None, distribution="normal",
+                 malformed_rate=0.0):
+        if distribution not in LATENCY_DISTRIBUTIONS:
+            raise ValueError(f"unknown latency distribution {distribution!r}")
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.malformed_rate = malformed_rate
+        self.distribution = distribution
+        self.seed = seed
+        self.calls = 0
+        self._attempts = {}
+
+    def _rng(self, prompt):
+        attempt = self._attempts.get(prompt, 0)
+        self._attempts[prompt] = attempt + 1
+        digest = hashlib.sha256(f"{self.seed}:{attempt}:{prompt}".encode("utf-8")).digest()
+        return random.Random(digest)
+
+    def _delay(self, rng):
+        return max(0.0, LATENCY_DISTRIBUTIONS[self.distribution](rng, self.latency, self.jitter))
+
+    def _response(self, prompt, rng):
+        match = _COUNT.search(prompt)
+        count = int(match.group(1)) if match else 5
+        topic = prompt.strip().splitlines()[0][:40]
+        text = json.dumps({"mcqs": [{
+            "mcq": f"Question {n + 1} about {topic}?",
+            "options": {"a": "first", "b": "second", "c": "third", "d": "fourth"},
+            "correct": "abcd"[n % 4],
+        } for n in range(count)]})
+        if rng.random() < self.malformed_rate:
+            text = text[:rng.randrange(1, len(text))]
+        # Same rough 4-characters-per-token estimate as documents.estimate_tokens
+        metrics.record_tokens(self.model_name, len(prompt) // 4, len(text) // 4)
+        return text
+
+    async def generate(self, prompt):
+        self.calls += 1
+        rng = self._rng(prompt)
+        await asyncio.sleep(self._delay(rng))
+        if rng.random() < self.failure_rate:
+            raise TransientBackendError("simulated quota error")
+        return self._response(prompt, rng)
+
+    # Streams the same response in small chunks spread over the latency
+    async def stream(self, prompt, chunk_size=16):
+        self.calls += 1
+        rng = self._rng(prompt)
+        if rng.random() < self.failure_rate:
+            raise TransientBackendError("simulated quota error")
+        text = self._response(prompt, rng)
+        chunks = [text[i:i + chunk_size] for i in range(0, len(text), chunk_size)]
+        delay = self._delay(rng) / len(chunks)
+        for chunk in chunks:
+            await asyncio.sleep(delay)
+            yield chunk
+
+
+def _fake_from_env():
+    seed = os.getenv("QUIZ_FAKE_SEED", "0")
+    return FakeBackend(
+        latency=float(os.getenv("QUIZ_FAKE_LATENCY", "1.5")),
+        jitter=float(os.getenv("QUIZ_FAKE_JITTER", "0.5")),
+        failure_rate=float(os.getenv("QUIZ_FAKE_FAILURE_RATE", "0")),
+        seed=seed,
+        distribution=os.getenv("QUIZ_FAKE_DISTRIBUTION", "lognormal"),
+        malformed_rate=float(os.getenv("QUIZ_FAKE_MALFORMED_RATE", "0")),
+    )
+
+
+# Backend selected by QUIZ_MODEL_BACKEND
+def make_backend(name=None):
+    name = name or MODEL_BACKEND
+    if name == "gemini":
+        return GeminiBackend()
+    if name == "fake":
+        return _fake_from_env()
+    raise ValueError(f"unknown model backend {name!r}")
@@ -0,0 +1,167 @@
+import asyncio
+import hashlib
+import math
+import os
+import random
+import re
+
+CHUNK_MAX_TOKENS = int(os.getenv("QUIZ_CHUNK_MAX_TOKENS", "2000"))
+CHUNK_MIN_TOKENS = int(os.getenv("QUIZ_CHUNK_MIN_TOKENS", "600"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("QUIZ_CHUNK_OVERLAP_TOKENS", "150"))
+# Questions whose word shingles overlap at least this much are treated as duplicates
+DUPLICATE_THRESHOLD = 0.6
+# Questions asked of each chunk beyond its share of the quiz, to make up for
+# near-duplicates dropped across chunks
+CHUNK_EXTRA_QUESTIONS = 2
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+_WORD = re.compile(r"\w+")
+
+
+# Rough token count (about four characters per token for English text)
+def estimate_tokens(text):
+    return (len(text) + 3) // 4
+
+
+def _units(text, max_tokens):
+    # Paragraphs, broken into sentences, then words, then characters when too
+    # long for one chunk
+    for paragraph in re.split(r"\n\s*\n", text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if estimate_tokens(paragraph) <= max_tokens:
+            yield paragraph
+            continue
+        for sentence in _SENTENCE_END.split(paragraph):
+            if estimate_tokens(sentence) <= max_tokens:
+                yield sentence
+                continue
+            words = sentence.split()
+            step = max(1, max_tokens * 2 // 3)
+            for start in range(0, len(words), step):
+                unit = " ".join(words[start:start + step])
+                if estimate_tokens(unit) <= max_tokens:
+                    yield unit
+                    continue
+                # Very long words, or text without spaces (e.g. Chinese or Japanese)
+                size = max_tokens * 4
+                for offset in range(0, len(unit), size):
+                    yield unit[offset:offset + size]
+
+
+def _is_boundary(unit):
+    # Content-defined cut points: whether a chunk may end after this unit depends
+    # only on the unit itself, so an edit shifts boundaries locally instead of
+    # re-chunking (and regenerating) everything after it.
+    return hashlib.blake2b(unit.encode("utf-8"), digest_size=2).digest()[0] % 4 == 0
+
+
+def _tail(units, overlap_tokens):
+    tail, size = [], 0
+    for unit in reversed(units):
+        size += estimate_tokens(unit)
+        if size > overlap_tokens:
+            break
+        tail.insert(0, unit)
+    return tail
+
+
+# Split `text` into chunks of at most `max_tokens`, each starting with up to
+# `overlap_tokens` of the previous chunk's closing text.
+def split_text(text, max_tokens=CHUNK_MAX_TOKENS, min_tokens=CHUNK_MIN_TOKENS,
+               overlap_tokens=CHUNK_OVERLAP_TOKENS):
+    chunks = []
+    current, size, fresh = [], 0, 0
+    for unit in _units(text, max_tokens - overlap_tokens):
+        unit_tokens = estimate_tokens(unit)
+        if fresh and size + unit_tokens > max_tokens:
+            chunks.append("\n\n".join(current))
+            current = _tail(current, overlap_tokens)
+            size, fresh = sum(estimate_tokens(u) for u in current), 0
+        current.append(unit)
+        size += unit_tokens
+        fresh += 1
+        if size >= min_tokens and _is_boundary(unit):
+            chunks.append("\n\n".join(current))
+            current = _tail(current, overlap_tokens)
+            size, fresh = sum(estimate_tokens(u) for u in current), 0
+    if fresh:
+        chunks.append("\n\n".join(current))
+    return chunks
+
+
+def shingles(text, size=3):
+    words = _WORD.findall(text.lower())
+    if len(words) <= size:
+        return {" ".join(words)}
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def jaccard(a, b):
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+# Drop questions whose text is a near-duplicate of one already kept. Pass the
+# same `seen` list across calls to deduplicate against earlier batches too.
+def deduplicate(questions, threshold=DUPLICATE_THRESHOLD, seen=None):
+    kept = []
+    kept_shingles = [] if seen is None else seen
+    for question in questions:
+        question_shingles = shingles(question["mcq"])
+        if any(jaccard(question_shingles, other) >= threshold for other in kept_shingles):
+            continue
+        kept.append(question)
+        kept_shingles.append(question_shingles)
+    return kept
+
+
+# Pick `quiz_size` questions round-robin across chunks so every part of the
+# document is represented. Seeded by the document so reruns give the same quiz.
+def sample_balanced(per_chunk, quiz_size, seed=None):
+    picker = random.Random(seed)
+    pools = [list(questions) for questions in per_chunk if questions]
+    for pool in pools:
+        picker.shuffle(pool)
+    picker.shuffle(pools)
+    selected = []
+    while pools and len(selected) < quiz_size:
+        for pool in list(pools):
+            if len(selected) == quiz_size:
+                break
+            selected.append(pool.pop())
+            if not pool:
+                pools.remove(pool)
+    return selected
+
+
+# Questions to ask of each of `chunks` chunks for a quiz of `quiz_size`: its
+# share plus a margin, and never fewer than a normal quiz so small quizzes
+# reuse the chunks' ordinary cache entries.
+def questions_per_chunk(quiz_size, chunks, minimum=5):
+    return max(minimum, math.ceil(quiz_size / max(1, chunks)) + CHUNK_EXTRA_QUESTIONS)
+
+
+# Generate a quiz for a document of any length on the service's event loop.
+# Chunks are generated concurrently through the service, so each chunk is
+# cached (and coalesced) on its own and unchanged chunks cost no API call.
+async def agenerate_document(service, text_content, quiz_level, quiz_size=5, fresh=False):
+    chunks = split_text(text_content)
+    count = questions_per_chunk(quiz_size, len(chunks))
+    results = await asyncio.gather(*(service.agenerate(chunk, quiz_level, fresh, count) for chunk in chunks),
+                                   return_exceptions=True)
+    failures = [result for result in results if isinstance(result, BaseException)]
+    if failures and len(failures) == len(results):
+        raise failures[0]
+
+    seen = []
+    per_chunk = [deduplicate(result, seen=seen) for result in results
+                 if not isinstance(result, BaseException)]
+    seed = hashlib.sha256(text_content.encode("utf-8")).hexdigest()
+    return sample_balanced(per_chunk, quiz_size, seed)
+
+
+def generate_document(service, text_content, quiz_level, quiz_size=5, timeout=None, fresh=False):
+    return service.run(agenerate_document(service, text_content, quiz_level, quiz_size, fresh), timeout)
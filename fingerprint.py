@@ -0,0 +1,240 @@
+import os
+import random
+import re
+import threading
+import time
+import zlib
+from array import array
+
+from quiz_cache import text_digest
+from storage import get_pool, init_db
+
+try:
+    import numpy as np
+except ImportError:  # pure-Python signatures, same values, just slower
+    np = None
+
+NUM_PERM = 64
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+SHINGLE_SIZE = 4
+# Estimated Jaccard similarity above which two texts share a quiz
+NEAR_DUP_THRESHOLD = float(os.getenv("QUIZ_NEAR_DUP_THRESHOLD", "0.75"))
+# How often a process picks up fingerprints added by other workers
+SYNC_INTERVAL = 30.0
+
+_PRIME = (1 << 31) - 1
+_picker = random.Random(20240917)
+_A = [_picker.randrange(1, _PRIME) for _ in range(NUM_PERM)]
+_B = [_picker.randrange(0, _PRIME) for _ in range(NUM_PERM)]
+
+_CITATION = re.compile(r"\[\s*(?:\d+|[a-z]|citation needed|note \d+)\s*\]", re.IGNORECASE)
+_NON_WORD = re.compile(r"[^\w\s]+")
+
+
+# Lower-case, drop citation markers like [1] or [a], punctuation and extra whitespace
+def normalize_document(text):
+    text = _CITATION.sub(" ", text.lower())
+    return " ".join(_NON_WORD.sub(" ", text).split())
+
+
+def shingle_hashes(text):
+    words = normalize_document(text).split()
+    if len(words) <= SHINGLE_SIZE:
+        grams = [" ".join(words)]
+    else:
+        grams = [" ".join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)]
+    return {zlib.crc32(gram.encode("utf-8")) & _PRIME for gram in grams}
+
+
+# MinHash signature: for each of NUM_PERM hash functions (a*x + b) mod p, the
+# minimum over the document's shingles
+def signature(text):
+    hashes = shingle_hashes(text)
+    if np is not None:
+        values = np.fromiter(hashes, dtype=np.uint64, count=len(hashes))
+        a = np.array(_A, dtype=np.uint64)[:, None]
+        b = np.array(_B, dtype=np.uint64)[:, None]
+        permuted = (a * values + b) % _PRIME
+        return array("I", permuted.min(axis=1).astype(np.uint32).tobytes())
+    return array("I", [min((a * x + b) % _PRIME for x in hashes) for a, b in zip(_A, _B)])
+
+
+def similarity(sig_a, sig_b):
+    return sum(1 for a, b in zip(sig_a, sig_b) if a == b) / NUM_PERM
+
+
+class FingerprintIndex:
+    """In-memory LSH table over MinHash signatures, keyed by text digest.
+
+    Signatures are split into BANDS bands of ROWS values; documents sharing any
+    band are candidates, and candidates are confirmed by estimated similarity.
+    """
+
+    def __init__(self, threshold=NEAR_DUP_THRESHOLD):
+        self.threshold = threshold
+        self._digests = []
+        self._signatures = []
+        self._known = set()
+        self._buckets = [{} for _ in range(BANDS)]
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._digests)
+
+    @staticmethod
+    def _band_keys(sig):
+        raw = sig.tobytes()
+        width = ROWS * sig.itemsize
+        return [raw[band * width:(band + 1) * width] for band in range(BANDS)]
+
+    def add(self, digest, sig):
+        with self._lock:
+            if digest in self._known:
+                return False
+            position = len(self._digests)
+            self._digests.append(digest)
+            self._signatures.append(sig)
+            self._known.add(digest)
+            for bucket, key in zip(self._buckets, self._band_keys(sig)):
+                bucket.setdefault(key, []).append(position)
+        return True
+
+    # Most similar indexed digest at or above the threshold, as (digest, score)
+    def query(self, sig, exclude=None):
+        candidates = set()
+        for bucket, key in zip(self._buckets, self._band_keys(sig)):
+            candidates.update(bucket.get(key, ()))
+        best, best_score = None, self.threshold
+        for position in candidates:
+            digest = self._digests[position]
+            if digest == exclude:
+                continue
+            score = similarity(sig, self._signatures[position])
+            if score >= best_score:
+                best, best_score = digest, score
+        return (best, best_score) if best is not None else (None, 0.0)
+
+
+class PersistentIndex(FingerprintIndex):
+    """FingerprintIndex backed by the text_fingerprints table.
+
+    Additions are written through; rows added by other processes are picked up
+    incrementally (by rowid) at most every SYNC_INTERVAL seconds.
+    """
+
+    def __init__(self, threshold=NEAR_DUP_THRESHOLD):
+        super().__init__(threshold)
+        self._last_rowid = 0
+        self._synced_at = 0.0
+
+    def sync(self, force=False):
+        if not force and time.monotonic() - self._synced_at < SYNC_INTERVAL:
+            return
+        init_db()
+        with get_pool().connection() as conn:
+            rows = conn.execute('''SELECT rowid, digest, signature FROM text_fingerprints
+                                   WHERE rowid > ? ORDER BY rowid''', (self._last_rowid,)).fetchall()
+        for rowid, digest, blob in rows:
+            sig = array("I")
+            sig.frombytes(blob)
+            self.add(digest, sig)
+            self._last_rowid = rowid
+        self._synced_at = time.monotonic()
+
+    def remember(self, text_content):
+        digest = text_digest(text_content)
+        if digest in self._known:
+            return
+        sig = signature(text_content)
+        init_db()
+        with get_pool().transaction() as conn:
+            conn.execute('''INSERT OR IGNORE INTO text_fingerprints (digest, signature, created_at)
+                            VALUES (?, ?, ?)''', (digest, sig.tobytes(), time.time()))
+        self.add(digest, sig)
+
+    # Digest of a previously seen, near-identical text (not the text itself)
+    def find_similar(self, text_content):
+        self.sync()
+        digest, _ = self.query(signature(text_content), exclude=text_digest(text_content))
+        return digest
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_index():
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = PersistentIndex()
+                _index.sync(force=True)
+    return _index
+
+
+def _synthetic_document(picker, vocabulary, length=80):
+    return " ".join(picker.choice(vocabulary) for _ in range(length)) + "."
+
+
+def _perturb(picker, text):
+    # The variations users actually paste: citation markers, whitespace, a word or two
+    words = text.split()
+    for _ in range(picker.randint(0, 2)):
+        words[picker.randrange(len(words))] = picker.choice(["the", "a", "its", "their"])
+    for _ in range(picker.randint(1, 4)):
+        words.insert(picker.randrange(len(words)), f"[{picker.randint(1, 99)}]")
+    return "  ".join(words) + "\n\n"
+
+
+# Benchmark: index `docs` synthetic articles, then look up perturbed copies of
+# stored articles (should hit) and unrelated articles (should miss).
+def benchmark(docs=100000, queries=1000, seed=0):
+    picker = random.Random(seed)
+    vocabulary = [f"w{n}" for n in range(5000)]
+    index = FingerprintIndex()
+    stored = []
+    start = time.perf_counter()
+    for n in range(docs):
+        text = _synthetic_document(picker, vocabulary)
+        index.add(str(n), signature(text))
+        if n < queries:
+            stored.append((str(n), text))
+    build_seconds = time.perf_counter() - start
+
+    hits = false_positives = 0
+    latencies = []
+    for digest, text in stored:
+        started = time.perf_counter()
+        match, _ = index.query(signature(_perturb(picker, text)))
+        latencies.append(time.perf_counter() - started)
+        hits += match == digest
+    for _ in range(queries):
+        started = time.perf_counter()
+        match, _ = index.query(signature(_synthetic_document(picker, vocabulary)))
+        latencies.append(time.perf_counter() - started)
+        false_positives += match is not None
+    latencies.sort()
+    return {
+        "docs": docs,
+        "build_seconds": build_seconds,
+        "hit_rate": hits / queries,
+        "false_positive_rate": false_positives / queries,
+        "p50_ms": latencies[len(latencies) // 2] * 1000,
+        "p99_ms": latencies[int(len(latencies) * 0.99)] * 1000,
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark near-duplicate text lookup")
+    parser.add_argument("--docs", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=1000)
+    args = parser.parse_args()
+    result = benchmark(args.docs, args.queries)
+    print(f"docs={result['docs']} build={result['build_seconds']:.1f}s "
+          f"({'numpy' if np is not None else 'pure Python'} signatures)")
+    print(f"near-duplicate hit rate={result['hit_rate']:.1%} false positives={result['false_positive_rate']:.1%}")
+    print(f"lookup p50={result['p50_ms']:.2f}ms p99={result['p99_ms']:.2f}ms")
@@ -0,0 +1,465 @@
+import asyncio
+import logging
+import os
+import queue
+import random
+import threading
+import time
+
+import fingerprint
+from backends import FakeBackend, is_retryable, make_backend
+import metrics
+import prompts
+import question_bank
+import quiz_cache
+from stream_parser import MCQStreamParser
+from validation import validate_questions, validate_response
+
+GENERATION_RATE = float(os.getenv("QUIZ_GENERATION_RATE", "1"))
+GENERATION_BURST = int(os.getenv("QUIZ_GENERATION_BURST", "5"))
+GENERATION_CONCURRENCY = int(os.getenv("QUIZ_GENERATION_CONCURRENCY", "4"))
+GENERATION_RETRIES = int(os.getenv("QUIZ_GENERATION_RETRIES", "4"))
+QUESTIONS_PER_QUIZ = 5
+# Follow-up requests for questions that failed validation
+REPAIR_ROUNDS = int(os.getenv("QUIZ_REPAIR_ROUNDS", "1"))
+# Reuse quizzes generated for near-identical texts (see fingerprint.py)
+NEAR_DUPLICATES = os.getenv("QUIZ_NEAR_DUPLICATES", "1") == "1"
+
+logger = logging.getLogger(__name__)
+
+
+class _StreamJob:
+    """One streamed generation shared by every session that asked for it.
+
+    Listeners get the questions published so far, then each new one, then
+    DONE. A repeat of an earlier question is dropped, as validate_response
+    does for complete responses. Runs on the service loop only, so no locking
+    is needed.
+    """
+
+    DONE = object()
+
+    def __init__(self):
+        self.task = None
+        self.questions = []
+        self._seen = set()
+        self._listeners = set()
+
+    def subscribe(self):
+        listener = asyncio.Queue()
+        for question in self.questions:
+            listener.put_nowait(question)
+        if self.task.done():
+            listener.put_nowait(self.DONE)
+        else:
+            self._listeners.add(listener)
+        return listener
+
+    def unsubscribe(self, listener):
+        self._listeners.discard(listener)
+
+    def publish(self, question):
+        if question["mcq"].lower() in self._seen:
+            return
+        self._seen.add(question["mcq"].lower())
+        self.questions.append(question)
+        for listener in self._listeners:
+            listener.put_nowait(question)
+
+    def finish(self):
+        if not self.task.cancelled():
+            self.task.exception()  # retrieved even when every listener has left
+        for listener in self._listeners:
+            listener.put_nowait(self.DONE)
+        self._listeners.clear()
+
+
+class TokenBucket:
+    """Async token bucket: `rate` requests per second with bursts up to `capacity`."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class GenerationService:
+    """Schedules quiz generation on a private event loop.
+
+    Requests with the same cache key share one in-flight backend call, calls
+    are admitted through a token bucket and a concurrency cap, and transient
+    failures are retried with jittered exponential backoff.
+    """
+
+    def __init__(self, backend, rate=GENERATION_RATE, burst=GENERATION_BURST,
+                 max_concurrency=GENERATION_CONCURRENCY, max_retries=GENERATION_RETRIES,
+                 base_delay=1.0, max_delay=30.0, use_cache=True):
+        self.backend = backend
+        self.rate = rate
+        self.burst = burst
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.use_cache = use_cache
+        self.stats = {"requests": 0, "coalesced": 0, "cache_hits": 0, "backend_calls": 0, "retries": 0,
+                      "near_duplicate_hits": 0, "rejected": 0, "top_ups": 0}
+        self._inflight = {}
+        self._streams = {}
+        self._loop = None
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_loop(self):
+        if self._loop is not None:
+            return self._loop
+        with self._start_lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                ready = threading.Event()
+
+                def run():
+                    asyncio.set_event_loop(loop)
+                    self._limiter = TokenBucket(self.rate, self.burst)
+                    self._semaphore = asyncio.Semaphore(self.max_concurrency)
+                    loop.call_soon(ready.set)
+                    loop.run_forever()
+
+                self._thread = threading.Thread(target=run, name="quiz-generation", daemon=True)
+                self._thread.start()
+                ready.wait()
+                self._loop = loop
+        return self._loop
+
+    # Run a coroutine on the service loop and wait for its result
+    def run(self, coro, timeout=None):
+        return asyncio.run_coroutine_threadsafe(coro, self._ensure_loop()).result(timeout)
+
+    # Blocking entry point for the Streamlit script thread
+    def generate(self, text_content, quiz_level, timeout=None, fresh=False, count=QUESTIONS_PER_QUIZ):
+        return self.run(self.agenerate(text_content, quiz_level, fresh, count), timeout)
+
+    # Blocking generator yielding each MCQ as soon as the model finishes it
+    def generate_stream(self, text_content, quiz_level, fresh=False):
+        loop = self._ensure_loop()
+        results = queue.Queue()
+        done = object()
+
+        async def pump():
+            try:
+                async for question in self.agenerate_stream(text_content, quiz_level, fresh):
+                    results.put(question)
+            except Exception as exc:
+                results.put(exc)
+            finally:
+                results.put(done)
+
+        future = asyncio.run_coroutine_threadsafe(pump(), loop)
+        try:
+            while True:
+                item = results.get()
+                if item is done:
+                    break
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            future.cancel()
+
+    def cache_key(self, text_content, quiz_level, count=QUESTIONS_PER_QUIZ):
+        return quiz_cache.cache_key(text_content, quiz_level, self.backend.model_name, prompts.PROMPT_VERSION,
+                                    None if count == QUESTIONS_PER_QUIZ else count)
+
+    # Must run on the service loop (use `generate` from other threads)
+    # `fresh` skips the cache lookup to get new questions for the same text;
+    # `count` asks for a quiz of another size (cached separately)
+    async def agenerate(self, text_content, quiz_level, fresh=False, count=QUESTIONS_PER_QUIZ):
+        self.stats["requests"] += 1
+        key = self.cache_key(text_content, quiz_level, count)
+        inflight_key = f"{key}:fresh" if fresh else key
+        task = self._inflight.get(inflight_key)
+        if task is not None:
+            self.stats["coalesced"] += 1
+            return await asyncio.shield(task)
+        task = asyncio.ensure_future(self._generate_uncoalesced(key, text_content, quiz_level, fresh, count))
+        self._inflight[inflight_key] = task
+        task.add_done_callback(lambda done: self._forget(inflight_key, done))
+        return await asyncio.shield(task)
+
+    # Drop a finished task's in-flight entry, unless another task already took its place
+    def _forget(self, inflight_key, task):
+        if self._inflight.get(inflight_key) is task:
+            del self._inflight[inflight_key]
+
+    # Streaming variant of `agenerate`. Cached or already in-flight quizzes are
+    # yielded from the shared result; otherwise the backend is streamed by a
+    # task of its own, so a consumer that stops reading (a page restarted
+    # mid-stream) detaches without cancelling the call other sessions wait on.
+    async def agenerate_stream(self, text_content, quiz_level, fresh=False):
+        self.stats["requests"] += 1
+        key = self.cache_key(text_content, quiz_level)
+        inflight_key = f"{key}:fresh" if fresh else key
+        job = self._streams.get(inflight_key)
+        if job is None and inflight_key not in self._inflight and self.use_cache and not fresh:
+            questions = await asyncio.to_thread(self._cached, key, text_content, quiz_level)
+            if questions is not None:
+                self.stats["cache_hits"] += 1
+                for question in questions:
+                    yield question
+                return
+            # Another request for this key may have started during the lookup
+            job = self._streams.get(inflight_key)
+        task = self._inflight.get(inflight_key)
+        if job is None and task is not None:
+            self.stats["coalesced"] += 1
+            for question in await asyncio.shield(task):
+                yield question
+            return
+        if job is None:
+            job = _StreamJob()
+            job.task = asyncio.ensure_future(self._stream_generate(key, text_content, quiz_level, job))
+            self._streams[inflight_key] = job
+            # Non-streaming requests for the same key wait on the task instead of calling again
+            self._inflight[inflight_key] = job.task
+
+            def finished(task):
+                if self._streams.get(inflight_key) is job:
+                    del self._streams[inflight_key]
+                self._forget(inflight_key, task)
+                job.finish()
+
+            job.task.add_done_callback(finished)
+        else:
+            self.stats["coalesced"] += 1
+
+        listener = job.subscribe()
+        try:
+            while True:
+                question = await listener.get()
+                if question is _StreamJob.DONE:
+                    break
+                yield question
+        finally:
+            job.unsubscribe(listener)
+        if job.task.exception() is not None:
+            raise job.task.exception()
+
+    # Stream one quiz from the backend, publishing each valid question to the
+    # job's listeners. The call is retried only if it fails before the first
+    # question; a later failure keeps the questions already shown and asks
+    # for the rest with a top-up.
+    async def _stream_generate(self, key, text_content, quiz_level, job):
+        prompt = prompts.build_prompt(text_content, quiz_level, QUESTIONS_PER_QUIZ)
+        attempt = 0
+        while True:
+            await self._limiter.acquire()
+            parser = MCQStreamParser()
+            try:
+                async with self._semaphore:
+                    self.stats["backend_calls"] += 1
+                    with metrics.timed("model_stream_seconds", model=self.backend.model_name):
+                        async for chunk in self.backend.stream(prompt):
+                            completed = parser.feed(chunk)
+                            valid = validate_questions(completed)
+                            self.stats["rejected"] += len(completed) - len(valid)
+                            for question in valid:
+                                job.publish(question)
+                break
+            except Exception as exc:
+                if job.questions:
+                    logger.warning("stream failed after %d questions, topping up", len(job.questions),
+                                   exc_info=True)
+                    break
+                if not is_retryable(exc) or attempt >= self.max_retries:
+                    raise
+            delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+            attempt += 1
+            self.stats["retries"] += 1
+            await asyncio.sleep(delay)
+        try:
+            for question in await self._top_up(text_content, quiz_level, job.questions):
+                job.publish(question)
+        except Exception:
+            if not job.questions:
+                raise
+            logger.warning("top-up failed, keeping %d streamed questions", len(job.questions), exc_info=True)
+        if self.use_cache and job.questions:
+            await asyncio.to_thread(self._remember, key, text_content, quiz_level, job.questions)
+        return job.questions
+
+    async def _generate_uncoalesced(self, key, text_content, quiz_level, fresh=False, count=QUESTIONS_PER_QUIZ):
+        if self.use_cache and not fresh:
+            questions = await asyncio.to_thread(self._cached, key, text_content, quiz_level, count)
+            if questions is not None:
+                self.stats["cache_hits"] += 1
+                return questions
+        prompt = prompts.build_prompt(text_content, quiz_level, count)
+        questions, rejected = self._parse(await self._call_backend(prompt))
+        self.stats["rejected"] += rejected
+        questions = questions[:count]
+        questions += await self._top_up(text_content, quiz_level, questions, count)
+        if self.use_cache and questions:
+            await asyncio.to_thread(self._remember, key, text_content, quiz_level, questions, count)
+        return questions
+
+    # Ask only for the questions that failed validation instead of regenerating
+    # the whole quiz. Returns the new, non-duplicate valid questions.
+    async def _top_up(self, text_content, quiz_level, questions, count=QUESTIONS_PER_QUIZ):
+        extra = []
+        seen = {question["mcq"].lower() for question in questions}
+        for _ in range(REPAIR_ROUNDS):
+            missing = count - len(questions) - len(extra)
+            if missing <= 0:
+                break
+            self.stats["top_ups"] += 1
+            prompt = prompts.build_prompt(text_content, quiz_level, missing)
+            more, rejected = self._parse(await self._call_backend(prompt))
+            self.stats["rejected"] += rejected
+            for question in more[:missing]:
+                if question["mcq"].lower() not in seen:
+                    seen.add(question["mcq"].lower())
+                    extra.append(question)
+        return extra
+
+    # Digests of the near-duplicate texts whose cached quizzes `_cached` would
+    # serve for `texts`, so callers can check them like the texts themselves
+    def near_duplicate_sources(self, texts):
+        if not (self.use_cache and NEAR_DUPLICATES):
+            return []
+        index = fingerprint.get_index()
+        return [digest for digest in map(index.find_similar, texts) if digest is not None]
+
+    # Cached quiz for this exact text, else for a previously seen near-duplicate
+    # (same article with different whitespace, citation markers or small edits)
+    def _cached(self, key, text_content, quiz_level, count=QUESTIONS_PER_QUIZ):
+        with metrics.timed("quiz_cache_lookup_seconds"):
+            questions = quiz_cache.get(key)
+            if questions is not None:
+                metrics.inc("quiz_cache_lookups_total", result="hit")
+                return questions
+            if NEAR_DUPLICATES:
+                digest = fingerprint.get_index().find_similar(text_content)
+                if digest is not None:
+                    questions = quiz_cache.get(quiz_cache.digest_cache_key(
+                        digest, quiz_level, self.backend.model_name, prompts.PROMPT_VERSION,
+                        None if count == QUESTIONS_PER_QUIZ else count))
+            if questions is not None:
+                self.stats["near_duplicate_hits"] += 1
+            metrics.inc("quiz_cache_lookups_total", result="near_duplicate" if questions is not None else "miss")
+            return questions
+
+    @staticmethod
+    def _parse(response_text):
+        with metrics.timed("response_parse_seconds"):
+            return validate_response(response_text)
+
+    # Persist freshly generated questions in the question bank, and in the quiz
+    # cache only when the quiz is complete: a short quiz cached for the full
+    # TTL would be served to every later request without another top-up.
+    def _remember(self, key, text_content, quiz_level, questions, count=QUESTIONS_PER_QUIZ):
+        question_bank.store_questions(text_content, quiz_level, questions)
+        if len(questions) < count:
+            return
+        quiz_cache.put(key, questions)
+        if NEAR_DUPLICATES:
+            fingerprint.get_index().remember(text_content)
+
+    async def _call_backend(self, prompt):
+        attempt = 0
+        while True:
+            await self._limiter.acquire()
+            async with self._semaphore:
+                self.stats["backend_calls"] += 1
+                try:
+                    with metrics.timed("model_call_seconds", model=self.backend.model_name):
+                        return await self.backend.generate(prompt)
+                except Exception as exc:
+                    if not is_retryable(exc) or attempt >= self.max_retries:
+                        raise
+            # Full jitter keeps retrying sessions from hitting the quota in lockstep
+            delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+            attempt += 1
+            self.stats["retries"] += 1
+            await asyncio.sleep(delay)
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+# Process-wide service shared by every Streamlit session
+def get_service():
+    global _service
+    if _service is None:
+        with _service_lock:
+            if _service is None:
+                _service = GenerationService(make_backend())
+                metrics.register_gauges("generation", lambda: dict(_service.stats))
+    return _service
+
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] if ordered else 0.0
+
+
+# Benchmark: `requests` concurrent generations over `distinct` texts against
+# the fake backend, reporting throughput, latency and how many calls were saved.
+def benchmark(requests=200, distinct=50, latency=0.3, jitter=0.1, failure_rate=0.05,
+              rate=50.0, burst=10, max_concurrency=8, seed=0):
+    backend = FakeBackend(latency, jitter, failure_rate, seed)
+    service = GenerationService(backend, rate=rate, burst=burst, max_concurrency=max_concurrency,
+                                base_delay=0.05, use_cache=False)
+    picker = random.Random(seed)
+    texts = [f"Benchmark document {picker.randrange(distinct)}" for _ in range(requests)]
+    latencies = []
+
+    async def one(text):
+        start = time.perf_counter()
+        await service.agenerate(text, "easy")
+        latencies.append(time.perf_counter() - start)
+
+    async def run_all():
+        await asyncio.gather(*(one(text) for text in texts))
+
+    start = time.perf_counter()
+    service.run(run_all())
+    wall = time.perf_counter() - start
+    return {
+        "requests": requests,
+        "throughput": requests / wall,
+        "p50": _percentile(latencies, 0.50),
+        "p95": _percentile(latencies, 0.95),
+        **service.stats,
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark the generation service with a fake backend")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--distinct", type=int, default=50, help="number of distinct source texts")
+    parser.add_argument("--latency", type=float, default=0.3, help="mean fake backend latency in seconds")
+    parser.add_argument("--failure-rate", type=float, default=0.05)
+    parser.add_argument("--rate", type=float, default=50.0, help="token bucket refill rate per second")
+    parser.add_argument("--concurrency", type=int, default=8)
+    args = parser.parse_args()
+    result = benchmark(args.requests, args.distinct, args.latency, failure_rate=args.failure_rate,
+                       rate=args.rate, max_concurrency=args.concurrency)
+    print(f"requests={result['requests']} throughput={result['throughput']:.1f}/s "
+          f"p50={result['p50'] * 1000:.0f}ms p95={result['p95'] * 1000:.0f}ms "
+          f"backend_calls={result['backend_calls']} coalesced={result['coalesced']} retries={result['retries']}")
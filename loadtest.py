@@ -0,0 +1,188 @@
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+import auth
+import generation
+import storage
+from backends import LATENCY_DISTRIBUTIONS, FakeBackend
+
+STAGES = ("signup", "login", "generate", "submit", "history")
+
+
+class StageRecorder:
+    """Thread-safe latency samples and error counts per stage."""
+
+    def __init__(self):
+        self.samples = {stage: [] for stage in STAGES}
+        self.errors = {stage: 0 for stage in STAGES}
+        self.locked = 0
+        self._lock = threading.Lock()
+
+    def time(self, stage, func, *args):
+        start = time.perf_counter()
+        try:
+            return func(*args)
+        except Exception as exc:
+            with self._lock:
+                self.errors[stage] += 1
+                if isinstance(exc, sqlite3.OperationalError) and "locked" in str(exc):
+                    self.locked += 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.samples[stage].append(elapsed)
+
+
+def _percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] if ordered else 0.0
+
+
+# One simulated user: signup -> login -> (generate -> submit) x quizzes -> history
+def _user_flow(recorder, service, user, texts, quizzes, picker):
+    username = f"load-{user}"
+    password = f"password-{user}"
+    recorder.time("signup", auth.signup, username, password)
+    if not recorder.time("login", auth.authenticate, username, password):
+        raise RuntimeError(f"login failed for {username}")
+    token = auth.issue_token(username)
+    for _ in range(quizzes):
+        level = picker.choice(("easy", "medium", "hard"))
+        questions = recorder.time("generate", service.generate, picker.choice(texts), level)
+        if auth.verify_token(token) != username:
+            raise RuntimeError("session token rejected")
+        results = []
+        for question in questions:
+            selected = question["options"][picker.choice(list(question["options"]))]
+            correct = question["options"][question["correct"]]
+            results.append((question["mcq"], selected, correct, selected == correct))
+        if results:
+            recorder.time("submit", storage.submit_quiz_attempt, username, level, results)
+    recorder.time("history", lambda: (storage.fetch_quiz_history_page(username),
+                                      storage.fetch_user_stats(username)))
+
+
+# Run `users` concurrent users against a scratch database and the fake backend
+def run(users=50, quizzes=3, distinct_texts=20, latency=1.5, jitter=0.5, distribution="lognormal",
+        failure_rate=0.05, malformed_rate=0.05, rate=20.0, burst=10, concurrency=8, seed=0, path=None):
+    tmpdir = None
+    if path is None:
+        tmpdir = tempfile.TemporaryDirectory()
+        path = os.path.join(tmpdir.name, "loadtest.db")
+    with storage.temporary_pool(path) as pool:
+        storage.init_db()
+        backend = FakeBackend(latency, jitter, failure_rate, seed, distribution, malformed_rate)
+        service = generation.GenerationService(backend, rate=rate, burst=burst, max_concurrency=concurrency,
+                                               base_delay=0.2)
+        texts = [f"Load test article {n}. " + " ".join(f"word{(n * 7 + i) % 97}" for i in range(60))
+                 for n in range(distinct_texts)]
+        recorder = StageRecorder()
+        failed_flows = []
+
+        def user_thread(user):
+            try:
+                _user_flow(recorder, service, user, texts, quizzes, random.Random(f"{seed}:{user}"))
+            except Exception as exc:
+                failed_flows.append(repr(exc))
+
+        threads = [threading.Thread(target=user_thread, args=(user,)) for user in range(users)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wall = time.perf_counter() - start
+
+        stages = {}
+        for stage in STAGES:
+            ordered = sorted(recorder.samples[stage])
+            stages[stage] = {
+                "count": len(ordered),
+                "errors": recorder.errors[stage],
+                "p50": _percentile(ordered, 0.50),
+                "p95": _percentile(ordered, 0.95),
+                "p99": _percentile(ordered, 0.99),
+            }
+        report = {
+            "users": users,
+            "wall_seconds": wall,
+            "flows_per_second": (users - len(failed_flows)) / wall,
+            "failed_flows": len(failed_flows),
+            "stages": stages,
+            "sqlite": {
+                "locked_errors": recorder.locked,
+                "pool_checkouts": pool.checkouts,
+                "pool_waits": pool.waits,
+                "pool_wait_seconds": pool.wait_seconds,
+            },
+            "generation": dict(service.stats),
+        }
+    if tmpdir is not None:
+        tmpdir.cleanup()
+    return report
+
+
+def print_report(report):
+    print(f"users={report['users']} wall={report['wall_seconds']:.1f}s "
+          f"throughput={report['flows_per_second']:.2f} flows/s failed={report['failed_flows']}")
+    print(f"{'stage':<9} {'count':>6} {'errors':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for stage, row in report["stages"].items():
+        print(f"{stage:<9} {row['count']:>6} {row['errors']:>6} {row['p50'] * 1000:>8.1f} "
+              f"{row['p95'] * 1000:>8.1f} {row['p99'] * 1000:>8.1f}")
+    sqlite_report = report["sqlite"]
+    print(f"sqlite: {sqlite_report['locked_errors']} 'database is locked' errors, "
+          f"{sqlite_report['pool_waits']} of {sqlite_report['pool_checkouts']} checkouts waited "
+          f"({sqlite_report['pool_wait_seconds']:.2f}s total)")
+    print("generation:", report["generation"])
+
+
+# Budgets like "generate=5" or "submit=0.05" (p95 seconds) that fail the run
+def check_budgets(report, budgets):
+    violations = []
+    for budget in budgets:
+        stage, limit = budget.split("=")
+        p95 = report["stages"][stage]["p95"]
+        if p95 > float(limit):
+            violations.append(f"{stage} p95 {p95:.3f}s exceeds {float(limit):.3f}s")
+    if report["failed_flows"]:
+        violations.append(f"{report['failed_flows']} user flows failed")
+    if report["sqlite"]["locked_errors"]:
+        violations.append(f"{report['sqlite']['locked_errors']} 'database is locked' errors")
+    return violations
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Offline load test: signup, login, generate, submit, history")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--quizzes", type=int, default=3, help="quizzes per user")
+    parser.add_argument("--texts", type=int, default=20, help="distinct source texts")
+    parser.add_argument("--latency", type=float, default=1.5, help="fake model latency (mean/median seconds)")
+    parser.add_argument("--jitter", type=float, default=0.5)
+    parser.add_argument("--distribution", choices=sorted(LATENCY_DISTRIBUTIONS), default="lognormal")
+    parser.add_argument("--failure-rate", type=float, default=0.05)
+    parser.add_argument("--malformed-rate", type=float, default=0.05)
+    parser.add_argument("--rate", type=float, default=20.0, help="model requests per second")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-p95", action="append", default=[], metavar="STAGE=SECONDS",
+                        help="fail if the stage's p95 exceeds the budget (repeatable)")
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args()
+
+    result = run(args.users, args.quizzes, args.texts, args.latency, args.jitter, args.distribution,
+                 args.failure_rate, args.malformed_rate, args.rate, seed=args.seed)
+    print_report(result)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as report_file:
+            json.dump(result, report_file, indent=2)
+    problems = check_budgets(result, args.max_p95)
+    for problem in problems:
+        print("FAIL:", problem)
+    sys.exit(1 if problems else 0)
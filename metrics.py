@@ -0,0 +1,332 @@
+import functools
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Prometheus text endpoint on this port (e.g. 9464); unset disables it
+METRICS_PORT = os.getenv("QUIZ_METRICS_PORT")
+# Interface the endpoint listens on; loopback unless a scraper on another
+# host needs it, since the endpoint has no authentication
+METRICS_HOST = os.getenv("QUIZ_METRICS_HOST", "127.0.0.1")
+# Periodic JSON snapshot written to this path; unset disables it
+METRICS_DUMP_PATH = os.getenv("QUIZ_METRICS_DUMP")
+METRICS_DUMP_INTERVAL = float(os.getenv("QUIZ_METRICS_DUMP_INTERVAL", "60"))
+# Sessions may only switch the sampling profiler on when this is set
+PROFILING = os.getenv("QUIZ_PROFILING", "0") == "1"
+
+# Histogram bucket upper bounds in seconds: sub-millisecond DB reads up to
+# multi-second model calls
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+logger = logging.getLogger(__name__)
+
+
+class Histogram:
+    """Cumulative-bucket latency histogram (not thread-safe; guarded by the registry lock)."""
+
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+    # Upper bucket bound containing the given quantile (an estimate, as in Prometheus)
+    def quantile(self, fraction):
+        rank = fraction * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            seen += count
+            if seen >= rank and count:
+                return bound
+        return float("inf") if self.count else 0.0
+
+
+class Registry:
+    """Process-wide counters, histograms and gauge callbacks, keyed by (name, labels)."""
+
+    def __init__(self):
+        self._counters = {}
+        self._histograms = {}
+        self._gauges = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    # `collect` returns {suffix: number}; each is exported as gauge prefix_suffix.
+    # Used for counters other modules already keep (pool, cache, service stats).
+    def register_gauges(self, prefix, collect):
+        with self._lock:
+            self._gauges[prefix] = collect
+
+    def _collect_gauges(self):
+        with self._lock:
+            collectors = list(self._gauges.items())
+        gauges = {}
+        for prefix, collect in collectors:
+            try:
+                values = collect()
+            except Exception:
+                logger.debug("gauge collector %s failed", prefix, exc_info=True)
+                continue
+            for suffix, value in values.items():
+                if isinstance(value, (int, float)):
+                    gauges[f"{prefix}_{suffix}"] = value
+        return gauges
+
+    def snapshot(self):
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: (list(h.counts), h.sum, h.count, h.quantile(0.5), h.quantile(0.95))
+                          for key, h in self._histograms.items()}
+        return {
+            "time": time.time(),
+            "counters": [{"name": name, "labels": dict(labels), "value": value}
+                         for (name, labels), value in sorted(counters.items())],
+            "histograms": [{"name": name, "labels": dict(labels), "count": count, "sum": total,
+                            "p50": p50, "p95": p95}
+                           for (name, labels), (_, total, count, p50, p95) in sorted(histograms.items())],
+            "gauges": self._collect_gauges(),
+        }
+
+    def render_prometheus(self):
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((key, (list(h.counts), h.sum, h.count)) for key, h in self._histograms.items())
+        lines = []
+        declared = set()
+        for (name, labels), value in counters:
+            if name not in declared:
+                declared.add(name)
+                lines.append(f"# TYPE {name} counter")
+            lines.append(f"{name}{_labels(labels)} {value}")
+        for (name, labels), (counts, total, count) in histograms:
+            if name not in declared:
+                declared.add(name)
+                lines.append(f"# TYPE {name} histogram")
+            cumulative = 0
+            for bound, bucket_count in zip(BUCKETS, counts):
+                cumulative += bucket_count
+                lines.append(f"{name}_bucket{_labels(labels + (('le', repr(bound)),))} {cumulative}")
+            lines.append(f"{name}_bucket{_labels(labels + (('le', '+Inf'),))} {count}")
+            lines.append(f"{name}_sum{_labels(labels)} {total}")
+            lines.append(f"{name}_count{_labels(labels)} {count}")
+        for name, value in sorted(self._collect_gauges().items()):
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in labels)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + "}"
+
+
+registry = Registry()
+inc = registry.inc
+observe = registry.observe
+register_gauges = registry.register_gauges
+
+
+class timed:
+    """Record the duration of a block or function in histogram `name`.
+
+    As a decorator, an `op` label with the function name is added unless one
+    is given. Failures are timed too and counted in `{name}_errors_total`.
+    """
+
+    def __init__(self, name, **labels):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        observe(self.name, time.perf_counter() - self._start, **self.labels)
+        # Streamlit's rerun/stop signals are control flow, not failures
+        if exc_type is not None and issubclass(exc_type, Exception) and "streamlit" not in exc_type.__module__:
+            inc(f"{self.name.removesuffix('_seconds')}_errors_total", **self.labels)
+        return False
+
+    def __call__(self, func):
+        labels = {"op": func.__name__, **self.labels}
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with timed(self.name, **labels):
+                return func(*args, **kwargs)
+        return wrapper
+
+
+# Token counts from a Gemini response's usage_metadata (or a fake backend's
+# estimate), per model and direction
+def record_tokens(model, prompt_tokens, output_tokens):
+    if prompt_tokens:
+        inc("model_tokens_total", prompt_tokens, model=model, kind="prompt")
+    if output_tokens:
+        inc("model_tokens_total", output_tokens, model=model, kind="output")
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] == "/metrics.json":
+            body, content_type = json.dumps(registry.snapshot()), "application/json"
+        elif self.path.split("?")[0] in ("/", "/metrics"):
+            body, content_type = registry.render_prometheus(), "text/plain; version=0.0.4"
+        else:
+            self.send_error(404)
+            return
+        data = body.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_http_server(port, host=METRICS_HOST):
+    server = ThreadingHTTPServer((host, int(port)), _Handler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
+
+
+# Write a JSON snapshot to `path` every `interval` seconds (atomically, so
+# readers never see a partial file)
+def start_json_dump(path, interval=METRICS_DUMP_INTERVAL):
+    def run():
+        while True:
+            time.sleep(interval)
+            try:
+                tmp_path = f"{path}.tmp"
+                with open(tmp_path, "w", encoding="utf-8") as dump_file:
+                    json.dump(registry.snapshot(), dump_file)
+                os.replace(tmp_path, path)
+            except OSError:
+                logger.warning("could not write metrics to %s", path, exc_info=True)
+
+    thread = threading.Thread(target=run, name="metrics-dump", daemon=True)
+    thread.start()
+    return thread
+
+
+_exporters_started = False
+_exporters_lock = threading.Lock()
+
+
+# Start the configured exporters, once per process
+def start_exporters():
+    global _exporters_started
+    with _exporters_lock:
+        if _exporters_started:
+            return
+        _exporters_started = True
+    if METRICS_PORT:
+        try:
+            start_http_server(METRICS_PORT)
+        except OSError:
+            # Another process (e.g. a second Streamlit server) already owns the port
+            logger.warning("metrics port %s unavailable", METRICS_PORT, exc_info=True)
+    if METRICS_DUMP_PATH:
+        start_json_dump(METRICS_DUMP_PATH)
+
+
+class SamplingProfiler:
+    """Samples one thread's Python stack every `interval` seconds.
+
+    Cheap enough to leave on for a single session: the sampled thread is
+    never traced, only inspected from a background thread.
+    """
+
+    def __init__(self, thread_id=None, interval=0.005, max_depth=30):
+        self.thread_id = thread_id or threading.get_ident()
+        self.interval = interval
+        self.max_depth = max_depth
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = traceback.extract_stack(frame, limit=self.max_depth)
+            self.stacks[tuple(f"{os.path.basename(entry.filename)}:{entry.name}" for entry in stack)] += 1
+            self.samples += 1
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._sample, name="sampling-profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._stop.set()
+        self._thread.join()
+        return False
+
+    # (function, share of samples it was on the stack, share it was executing)
+    def top(self, limit=15):
+        inclusive, own = Counter(), Counter()
+        for stack, count in self.stacks.items():
+            for function in set(stack):
+                inclusive[function] += count
+            own[stack[-1]] += count
+        total = self.samples or 1
+        return [(function, count / total, own[function] / total) for function, count in inclusive.most_common(limit)]
+
+    # Folded stacks ("a;b;c count"), the input format of flamegraph tools
+    def folded(self):
+        return "\n".join(f"{';'.join(stack)} {count}" for stack, count in self.stacks.most_common())
+
+
+# Benchmark: cost of one timed block and of rendering the endpoint
+def benchmark(iterations=200000, series=50):
+    bench = Registry()
+    start = time.perf_counter()
+    for n in range(iterations):
+        begin = time.perf_counter()
+        bench.observe("bench_seconds", time.perf_counter() - begin, op=f"op{n % series}")
+    per_call_us = (time.perf_counter() - start) / iterations * 1e6
+    start = time.perf_counter()
+    text = bench.render_prometheus()
+    render_ms = (time.perf_counter() - start) * 1000
+    return {"timed_us": per_call_us, "render_ms": render_ms, "lines": text.count("\n")}
+
+
+if __name__ == "__main__":
+    result = benchmark()
+    print(f"timed block overhead {result['timed_us']:.2f}us; "
+          f"rendering {result['lines']} lines took {result['render_ms']:.1f}ms")
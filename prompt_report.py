@@ -0,0 +1,88 @@
+import json
+import time
+
+import prompts
+from documents import estimate_tokens
+
+# Fixed corpus: the article excerpt from the old few-shot example, whole and
+# paragraph by paragraph, so results are comparable between runs.
+_ARTICLE = prompts.LEGACY_FEW_SHOT_HISTORY[0]["parts"][0].split("\n\nYou are an expert")[0][len("TEXT:\n"):]
+CORPUS = [_ARTICLE] + _ARTICLE.split("\n\n")
+
+
+def legacy_contents(text_content, quiz_level):
+    return prompts.LEGACY_FEW_SHOT_HISTORY + [
+        {"role": "user", "parts": [prompts.build_legacy_prompt(text_content, quiz_level)]},
+    ]
+
+
+def compact_contents(text_content, quiz_level):
+    return [{"role": "user", "parts": [prompts.build_prompt(text_content, quiz_level)]}]
+
+
+def _estimate(contents, prefix=""):
+    return estimate_tokens(prefix + "".join(part for message in contents for part in message["parts"]))
+
+
+# Estimated input tokens per request for both prompt versions (offline). The
+# response schema is billed as input too, so it counts towards compact.
+def estimate_report(quiz_level="medium"):
+    schema_tokens = estimate_tokens(json.dumps(prompts.RESPONSE_SCHEMA))
+    rows = []
+    for text_content in CORPUS:
+        rows.append({
+            "text_tokens": estimate_tokens(text_content),
+            "legacy": _estimate(legacy_contents(text_content, quiz_level)),
+            "compact": _estimate(compact_contents(text_content, quiz_level), prompts.SYSTEM_INSTRUCTION)
+            + schema_tokens,
+        })
+    return rows, schema_tokens
+
+
+# Exact token counts and latency from the live API (needs GEMINI_API_KEY)
+def live_report(quiz_level="medium"):
+    import os
+
+    import google.generativeai as genai
+
+    genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+    legacy_config = {key: value for key, value in prompts.GENERATION_CONFIG.items() if key != "response_schema"}
+    legacy_model = genai.GenerativeModel(prompts.MODEL_NAME, generation_config=legacy_config)
+    compact_model = genai.GenerativeModel(prompts.MODEL_NAME, generation_config=prompts.GENERATION_CONFIG,
+                                          system_instruction=prompts.SYSTEM_INSTRUCTION)
+    rows = []
+    for text_content in CORPUS:
+        row = {"text_tokens": estimate_tokens(text_content)}
+        for name, model, contents in (("legacy", legacy_model, legacy_contents(text_content, quiz_level)),
+                                      ("compact", compact_model, compact_contents(text_content, quiz_level))):
+            start = time.perf_counter()
+            response = model.generate_content(contents)
+            row[name] = response.usage_metadata.prompt_token_count
+            row[f"{name}_seconds"] = time.perf_counter() - start
+        rows.append(row)
+    return rows
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Compare input tokens of the legacy and compact prompts")
+    parser.add_argument("--live", action="store_true", help="measure exact tokens and latency with the API")
+    args = parser.parse_args()
+
+    if args.live:
+        rows = live_report()
+        print(f"{'text':>6} {'legacy':>8} {'compact':>8} {'legacy s':>9} {'compact s':>10}")
+        for row in rows:
+            print(f"{row['text_tokens']:>6} {row['legacy']:>8} {row['compact']:>8} "
+                  f"{row['legacy_seconds']:>9.2f} {row['compact_seconds']:>10.2f}")
+    else:
+        rows, schema_tokens = estimate_report()
+        print(f"{'text':>6} {'legacy':>8} {'compact':>8} {'saved':>6}  (estimated input tokens)")
+        for row in rows:
+            print(f"{row['text_tokens']:>6} {row['legacy']:>8} {row['compact']:>8} "
+                  f"{1 - row['compact'] / row['legacy']:>6.0%}")
+        print(f"compact includes the response schema: ~{schema_tokens} tokens, sent as generation config")
+    legacy = sum(row["legacy"] for row in rows)
+    compact = sum(row["compact"] for row in rows)
+    print(f"total: legacy={legacy} compact={compact} ({1 - compact / legacy:.0%} fewer input tokens)")
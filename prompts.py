@@ -0,0 +1,113 @@
+MODEL_NAME = "gemini-1.5-flash"
+# Bump whenever the prompt or schema changes so cached quizzes are regenerated
+PROMPT_VERSION = "2"
+
+# Static prefix sent once per model as the system instruction (and reused
+# through context caching where the backend supports it).
+SYSTEM_INSTRUCTION = (
+    "You are an expert in generating MCQ type quizzes from provided content. "
+    "Questions must not repeat and must be answerable from the text. "
+    "Each question has exactly four options keyed a, b, c and d, and "
+    "\"correct\" is the key of the right option."
+)
+
+PROMPT_TEMPLATE = "Text: {text_content}\nCreate {count} multiple choice questions at {quiz_level} difficulty."
+
+_OPTION = {"type": "string"}
+
+# Structured-output schema replacing the few-shot example
+RESPONSE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "mcqs": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "mcq": {"type": "string"},
+                    "options": {
+                        "type": "object",
+                        "properties": {"a": _OPTION, "b": _OPTION, "c": _OPTION, "d": _OPTION},
+                        "required": ["a", "b", "c", "d"],
+                    },
+                    "correct": {"type": "string", "format": "enum", "enum": ["a", "b", "c", "d"]},
+                },
+                "required": ["mcq", "options", "correct"],
+            },
+        },
+    },
+    "required": ["mcqs"],
+}
+
+GENERATION_CONFIG = {
+    "temperature": 1,
+    "top_p": 0.95,
+    "top_k": 40,
+    "max_output_tokens": 8192,
+    "response_mime_type": "application/json",
+    "response_schema": RESPONSE_SCHEMA,
+}
+
+
+def build_prompt(text_content, quiz_level, count=5):
+    return PROMPT_TEMPLATE.format(text_content=text_content, quiz_level=quiz_level, count=count)
+
+
+# Prompt version 1, kept for the footprint comparison in prompt_report.py: a
+# JSON template in every prompt plus a few-shot exchange sent as chat history.
+LEGACY_RESPONSE_JSON = {
+    "mcqs": [
+        {
+            "mcq": "multiple choice question1",
+            "options": {
+                "a": "choice here1",
+                "b": "choice here2",
+                "c": "choice here3",
+                "d": "choice here4",
+            },
+            "correct": "correct choice option in the form of a, b, c or d",
+        },
+        {
+            "mcq": "multiple choice question",
+            "options": {
+                "a": "choice here",
+                "b": "choice here",
+                "c": "choice here",
+                "d": "choice here",
+            },
+            "correct": "correct choice option in the form of a, b, c or d",
+        }
+    ]
+}
+
+LEGACY_PROMPT_TEMPLATE = """
+    Text: {text_content}
+    You are an expert in generating MCQ type quiz on the basis of provided content. 
+    Given the above text, create a quiz of 5 multiple choice questions keeping difficulty level as {quiz_level}. 
+    Make sure the questions are not repeated and check all the questions to be conforming the text as well.
+    Make sure to format your response like RESPONSE_JSON below and use it as a guide.
+    Ensure to make an array of 5 MCQs referring the following response json.
+    Here is the RESPONSE_JSON: 
+
+    {RESPONSE_JSON}
+    """
+
+LEGACY_FEW_SHOT_HISTORY = [
+    {
+        "role": "user",
+        "parts": [
+            "TEXT:\nArtificial intelligence (AI), in its broadest sense, is intelligence exhibited by machines, particularly computer systems. It is a field of research in computer science that develops and studies methods and software that enable machines to perceive their environment and use learning and intelligence to take actions that maximize their chances of achieving defined goals.[1] Such machines may be called AIs.\n\nSome high-profile applications of AI include advanced web search engines (e.g., Google Search); recommendation systems (used by YouTube, Amazon, and Netflix); interacting via human speech (e.g., Google Assistant, Siri, and Alexa); autonomous vehicles (e.g., Waymo); generative and creative tools (e.g., ChatGPT, and AI art); and superhuman play and analysis in strategy games (e.g., chess and Go). However, many AI applications are not perceived as AI: \"A lot of cutting edge AI has filtered into general applications, often without being called AI because once something becomes useful enough and common enough it's not labeled AI anymore.\"[2][3]\n\nThe various subfields of AI research are centered around particular goals and the use of particular tools. The traditional goals of AI research include reasoning, knowledge representation, planning, learning, natural language processing, perception, and support for robotics.[a] General intelligence—the ability to complete any task performable by a human on an at least equal level—is among the field's long-term goals.[4] To reach these goals, AI researchers have adapted and integrated a wide range of techniques, including search and mathematical optimization, formal logic, artificial neural networks, and methods based on statistics, operations research, and economics.[b] AI also draws upon psychology, linguistics, philosophy, neuroscience, and other fields.[5]\n\nYou are an expert in generating MCQ type quiz on the basis of provided content. \n    Given the above text, create a quiz of 3 multiple choice questions keeping difficulty level as {quiz_level}. \n    Make sure the questions are not repeated and check all the questions to be conforming the text as well.\n    Make sure to format your response like RESPONSE_JSON below and use it as a guide.\n    Ensure to make an array of 3 MCQs referring the following response json.\n    Here is the RESPONSE_JSON: \n{\"mcqs\": [\n            {\n                \"mcq\": \"multiple choice question1\",\n                \"options\": {\n                    \"a\": \"choice here1\",\n                    \"b\": \"choice here2\",\n                    \"c\": \"choice here3\",\n                    \"d\": \"choice here4\",\n                },\n                \"correct\": \"correct choice option in the form of a, b, c or d\",\n            },\n            {\n                \"mcq\": \"multiple choice question\",\n                \"options\": {\n                    \"a\": \"choice here\",\n                    \"b\": \"choice here\",\n                    \"c\": \"choice here\",\n                    \"d\": \"choice here\",\n                },\n                \"correct\": \"correct choice option in the form of a, b, c or d\",\n            },\n            {\n                \"mcq\": \"multiple choice question\",\n                \"options\": {\n                    \"a\": \"choice here\",\n                    \"b\": \"choice here\",\n                    \"c\": \"choice here\",\n                    \"d\": \"choice here\",\n                },\n                \"correct\": \"correct choice option in the form of a, b, c or d\",\n            }\n        ]\n}",
+        ],
+    },
+    {
+        "role": "model",
+        "parts": [
+            "```json\n{\"mcqs\": [{\"mcq\": \"What is the broad definition of Artificial Intelligence (AI)?\", \"options\": {\"a\": \"Intelligence demonstrated by animals and humans.\", \"b\": \"Intelligence displayed by machines, especially computer systems.\", \"c\": \"The study of human intelligence and behavior.\", \"d\": \"The development of advanced computer hardware.\"}, \"correct\": \"b\"}, {\"mcq\": \"Which of the following is NOT mentioned as a high-profile application of AI in the text?\", \"options\": {\"a\": \"Advanced web search engines like Google Search.\", \"b\": \"Recommendation systems used by platforms like YouTube and Netflix.\", \"c\": \"Developing new medical treatments and cures.\", \"d\": \"Generative and creative tools like ChatGPT and AI art.\"}, \"correct\": \"c\"}, {\"mcq\": \"What is considered a long-term goal in the field of AI research?\", \"options\": {\"a\": \"Creating AI that can perform specific tasks better than humans.\", \"b\": \"Developing AI that can play strategic games like chess and Go.\", \"c\": \"Achieving general intelligence, enabling AI to complete any task a human can.\", \"d\": \"Improving the efficiency of existing AI algorithms.\"}, \"correct\": \"c\"}]}\n```",
+        ],
+    },
+]
+
+
+def build_legacy_prompt(text_content, quiz_level):
+    return LEGACY_PROMPT_TEMPLATE.format(text_content=text_content, quiz_level=quiz_level,
+                                         RESPONSE_JSON=LEGACY_RESPONSE_JSON)
@@ -0,0 +1,152 @@
+import json
+import logging
+import os
+import threading
+import time
+
+from quiz_cache import text_digest as source_hash
+from storage import get_pool, init_db
+
+BANK_TOPICS_PATH = os.getenv("QUIZ_BANK_TOPICS", "bank_topics.json")
+BANK_LEVELS = ("easy", "medium", "hard")
+# Unflagged questions the warm-up worker aims to keep per topic and level
+BANK_TARGET = int(os.getenv("QUIZ_BANK_TARGET", "25"))
+BANK_WARMUP = os.getenv("QUIZ_BANK_WARMUP", "0") == "1"
+
+# Quality flags stored as a bitmask; only questions with no flags are served
+FLAG_OPTION_COUNT = 1
+FLAG_BAD_CORRECT = 2
+FLAG_DUPLICATE_OPTIONS = 4
+FLAG_EMPTY = 8
+
+logger = logging.getLogger(__name__)
+
+
+def quality_flags(question):
+    flags = 0
+    options = question.get("options") or {}
+    if not isinstance(options, dict) or len(options) != 4:
+        flags |= FLAG_OPTION_COUNT
+        options = options if isinstance(options, dict) else {}
+    if question.get("correct") not in options:
+        flags |= FLAG_BAD_CORRECT
+    values = [str(value).strip().lower() for value in options.values()]
+    if len(set(values)) != len(values):
+        flags |= FLAG_DUPLICATE_OPTIONS
+    if not str(question.get("mcq", "")).strip() or not all(values):
+        flags |= FLAG_EMPTY
+    return flags
+
+
+# Add generated questions to the bank (questions already banked are skipped)
+def store_questions(text_content, quiz_level, questions):
+    init_db()
+    digest = source_hash(text_content)
+    now = time.time()
+    rows = [(digest, quiz_level.lower(), str(question.get("mcq", "")), json.dumps(question.get("options")),
+             str(question.get("correct", "")), quality_flags(question), now) for question in questions]
+    with get_pool().transaction() as conn:
+        conn.executemany('''INSERT OR IGNORE INTO question_bank
+                            (source_hash, level, mcq, options, correct, flags, created_at)
+                            VALUES (?, ?, ?, ?, ?, ?, ?)''', rows)
+
+
+def count_questions(text_content, quiz_level):
+    init_db()
+    with get_pool().connection() as conn:
+        return conn.execute('''SELECT COUNT(*) FROM question_bank
+                               WHERE source_hash = ? AND level = ? AND flags = 0''',
+                            (source_hash(text_content), quiz_level.lower())).fetchone()[0]
+
+
+# Draw `count` banked questions for this text and level that `username` has not
+# answered before. Returns None when the bank cannot fill a whole quiz.
+def sample_questions(username, text_content, quiz_level, count=5):
+    init_db()
+    with get_pool().connection() as conn:
+        rows = conn.execute('''SELECT mcq, options, correct FROM question_bank
+                               WHERE source_hash = ? AND level = ? AND flags = 0
+                                 AND mcq NOT IN (SELECT question FROM quiz_results WHERE username = ?)
+                               ORDER BY random() LIMIT ?''',
+                            (source_hash(text_content), quiz_level.lower(), username, count)).fetchall()
+    if len(rows) < count:
+        return None
+    return [{"mcq": mcq, "options": json.loads(options), "correct": correct} for mcq, options, correct in rows]
+
+
+# Whether `username` has answered a banked question generated from any of
+# `texts` (or the texts with source hashes `hashes`) at this level. Cached
+# quizzes for those texts contain the same questions, so they must not be
+# served to this user again.
+def has_answered(username, texts, quiz_level, hashes=()):
+    hashes = [source_hash(text) for text in texts] + list(hashes)
+    init_db()
+    with get_pool().connection() as conn:
+        return conn.execute(f'''SELECT EXISTS (SELECT 1 FROM question_bank
+                                WHERE source_hash IN ({", ".join("?" * len(hashes))}) AND level = ?
+                                  AND mcq IN (SELECT question FROM quiz_results WHERE username = ?))''',
+                            (*hashes, quiz_level.lower(), username)).fetchone()[0] == 1
+
+
+# Curated topics as a list of {"title": ..., "text": ...} objects
+def load_topics(path=BANK_TOPICS_PATH):
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding="utf-8") as topics_file:
+        return json.load(topics_file)
+
+
+# Generate fresh questions until every topic/level has `target` servable
+# questions. Stops early for a topic when a round adds nothing new.
+def warm_bank(service, topics, levels=BANK_LEVELS, target=BANK_TARGET, max_rounds=10):
+    generated = 0
+    for topic in topics:
+        for level in levels:
+            for _ in range(max_rounds):
+                before = count_questions(topic["text"], level)
+                if before >= target:
+                    break
+                try:
+                    service.generate(topic["text"], level, fresh=True)
+                except Exception:
+                    logger.exception("warm-up failed for %r (%s)", topic.get("title"), level)
+                    break
+                after = count_questions(topic["text"], level)
+                generated += after - before
+                if after == before:
+                    break
+    return generated
+
+
+_warmup_started = False
+_warmup_lock = threading.Lock()
+
+
+# Fill the bank on a background thread, once per process
+def start_warmup(service, topics, levels=BANK_LEVELS, target=BANK_TARGET):
+    global _warmup_started
+    with _warmup_lock:
+        if _warmup_started or not topics:
+            return
+        _warmup_started = True
+    threading.Thread(target=warm_bank, args=(service, topics, levels, target),
+                     name="question-bank-warmup", daemon=True).start()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from dotenv import load_dotenv
+
+    from generation import get_service
+
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description="Pre-generate questions for curated topics")
+    parser.add_argument("topics", nargs="?", default=BANK_TOPICS_PATH, help="JSON list of {title, text}")
+    parser.add_argument("--levels", nargs="+", default=list(BANK_LEVELS))
+    parser.add_argument("--target", type=int, default=BANK_TARGET)
+    args = parser.parse_args()
+    topics = load_topics(args.topics)
+    added = warm_bank(get_service(), topics, args.levels, args.target)
+    print(f"added {added} questions for {len(topics)} topics")
@@ -0,0 +1,150 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+
+import metrics
+from storage import get_pool, init_db
+
+CACHE_TTL = float(os.getenv("QUIZ_CACHE_TTL", str(7 * 24 * 3600)))
+CACHE_MAX_BYTES = int(os.getenv("QUIZ_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+# last_access (and the hits column) is only written when older than this, so
+# a popular entry costs one write per interval instead of one per hit; LRU
+# eviction only needs that resolution
+ACCESS_INTERVAL = float(os.getenv("QUIZ_CACHE_ACCESS_INTERVAL", "60"))
+# Expired entries are rejected on read, so put only sweeps them this often
+SWEEP_INTERVAL = 60.0
+
+_stats = {"hits": 0, "misses": 0, "expired": 0, "evictions": 0}
+_stats_lock = threading.Lock()
+# Per database path: [running total of cached bytes or None, last sweep time].
+# The total is kept by put instead of summing the table on every write; other
+# processes sharing the file are not seen, so it is recounted with each sweep
+# and before evicting.
+_usage = {}
+_usage_lock = threading.Lock()
+
+
+def _count(name, amount=1):
+    with _stats_lock:
+        _stats[name] += amount
+
+
+# Hit/miss counters for this process
+def cache_stats():
+    with _stats_lock:
+        return dict(_stats)
+
+
+metrics.register_gauges("quiz_cache", cache_stats)
+
+
+# Whitespace differences should not change the key
+def normalize_text(text):
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def text_digest(text_content):
+    return hashlib.sha256(normalize_text(text_content).encode("utf-8")).hexdigest()
+
+
+# Content hash of everything that determines the generated quiz. `count` is
+# the number of questions asked for when not the default quiz size (which
+# keeps the keys it always had).
+def cache_key(text_content, quiz_level, model_name, prompt_version, count=None):
+    return digest_cache_key(text_digest(text_content), quiz_level, model_name, prompt_version, count)
+
+
+# Same key from a text digest, for looking up quizzes of a matched document
+def digest_cache_key(digest, quiz_level, model_name, prompt_version, count=None):
+    material = json.dumps([digest, quiz_level.lower(), model_name, prompt_version] + ([count] if count else []))
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+# Return the cached MCQs for `key`, or None on a miss or expired entry
+def get(key, ttl=CACHE_TTL):
+    init_db()
+    now = time.time()
+    pool = get_pool()
+    with pool.connection() as conn:
+        row = conn.execute("SELECT payload, size, created_at, last_access FROM quiz_cache WHERE key = ?",
+                           (key,)).fetchone()
+    if row is None:
+        _count("misses")
+        return None
+    payload, size, created_at, last_access = row
+    if ttl and now - created_at > ttl:
+        with pool.transaction() as conn:
+            if conn.execute("DELETE FROM quiz_cache WHERE key = ? AND created_at = ?", (key, created_at)).rowcount:
+                _adjust_total(pool, -size)
+        _count("expired")
+        _count("misses")
+        return None
+    if now - last_access >= ACCESS_INTERVAL:
+        with pool.transaction() as conn:
+            conn.execute("UPDATE quiz_cache SET last_access = ?, hits = hits + 1 WHERE key = ?", (now, key))
+    _count("hits")
+    return json.loads(payload)
+
+
+def put(key, mcqs, max_bytes=CACHE_MAX_BYTES):
+    init_db()
+    payload = json.dumps(mcqs)
+    now = time.time()
+    pool = get_pool()
+    with pool.transaction() as conn:
+        row = conn.execute("SELECT size FROM quiz_cache WHERE key = ?", (key,)).fetchone()
+        conn.execute('''INSERT INTO quiz_cache (key, payload, size, created_at, last_access) VALUES (?, ?, ?, ?, ?)
+                        ON CONFLICT (key) DO UPDATE SET
+                            payload = excluded.payload, size = excluded.size,
+                            created_at = excluded.created_at, last_access = excluded.last_access''',
+                     (key, payload, len(payload), now, now))
+        _evict(conn, pool, now, max_bytes, len(payload) - (row[0] if row else 0))
+
+
+def _adjust_total(pool, delta):
+    with _usage_lock:
+        usage = _usage.get(pool.path)
+        if usage is not None and usage[0] is not None:
+            usage[0] += delta
+
+
+# Drop expired entries (at most every SWEEP_INTERVAL), then least recently
+# used ones until under the size budget. `added` is the size change of the
+# entry just written.
+def _evict(conn, pool, now, max_bytes, added, ttl=CACHE_TTL):
+    evicted = 0
+    with _usage_lock:
+        usage = _usage.setdefault(pool.path, [None, 0.0])
+        total, swept = usage
+        sweep = ttl and now - swept >= SWEEP_INTERVAL
+        if sweep:
+            usage[1] = now
+    if sweep:
+        evicted += conn.execute("DELETE FROM quiz_cache WHERE created_at < ?", (now - ttl,)).rowcount
+        # Recount with every sweep to pick up other processes' writes
+        total = None
+    total = None if total is None else total + added
+    if total is None or total > max_bytes:
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM quiz_cache").fetchone()[0]
+    if total > max_bytes:
+        for key, size in conn.execute("SELECT key, size FROM quiz_cache ORDER BY last_access").fetchall():
+            if total <= max_bytes:
+                break
+            conn.execute("DELETE FROM quiz_cache WHERE key = ?", (key,))
+            total -= size
+            evicted += 1
+    with _usage_lock:
+        usage[0] = total
+    if evicted:
+        _count("evictions", evicted)
+
+
+def clear():
+    init_db()
+    with get_pool().transaction() as conn:
+        conn.execute("DELETE FROM quiz_cache")
+    with _usage_lock:
+        _usage.pop(get_pool().path, None)
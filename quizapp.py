@@ -1,157 +1,167 @@
 import os
-import google.generativeai as genai
+import time
+import uuid
+from contextlib import contextmanager
 from dotenv import load_dotenv
 import streamlit as st
-import json
-import sqlite3
+import metrics
+from documents import CHUNK_MAX_TOKENS, estimate_tokens, generate_document, split_text
+from generation import get_service
+from question_bank import BANK_WARMUP, has_answered, load_topics, sample_questions, start_warmup
+from auth import authenticate, issue_token, signup, verify_token
+from storage import init_db, submit_quiz_attempt, fetch_quiz_history_page, fetch_user_stats
 
 load_dotenv()
-genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
-
-# Initialize SQLite database
-def init_db():
-    conn = sqlite3.connect("quiz_app.db")
-    cursor = conn.cursor()
-    cursor.execute('''CREATE TABLE IF NOT EXISTS users (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        username TEXT UNIQUE NOT NULL,
-                        password TEXT NOT NULL
-                      )''')
-    cursor.execute('''CREATE TABLE IF NOT EXISTS quiz_results (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        username TEXT NOT NULL,
-                        question TEXT NOT NULL,
-                        user_answer TEXT NOT NULL,
-                        correct_answer TEXT NOT NULL,
-                        is_correct BOOLEAN NOT NULL
-                      )''')
-    conn.commit()
-    conn.close()
-
-# User authentication
-def authenticate(username, password):
-    conn = sqlite3.connect("quiz_app.db")
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM users WHERE username = ? AND password = ?", (username, password))
-    user = cursor.fetchone()
-    conn.close()
-    return user is not None
-
-# User signup
-def signup(username, password):
-    conn = sqlite3.connect("quiz_app.db")
-    cursor = conn.cursor()
-    try:
-        cursor.execute("INSERT INTO users (username, password) VALUES (?, ?)", (username, password))
-        conn.commit()
-        success = True
-    except sqlite3.IntegrityError:
-        success = False
-    conn.close()
-    return success
-
-# Save quiz result
-def save_quiz_result(username, question, user_answer, correct_answer, is_correct):
-    conn = sqlite3.connect("quiz_app.db")
-    cursor = conn.cursor()
-    cursor.execute('''INSERT INTO quiz_results (username, question, user_answer, correct_answer, is_correct)
-                      VALUES (?, ?, ?, ?, ?)''', (username, question, user_answer, correct_answer, is_correct))
-    conn.commit()
-    conn.close()
-
-# Fetch quiz history
-def fetch_quiz_history(username):
-    conn = sqlite3.connect("quiz_app.db")
-    cursor = conn.cursor()
-    cursor.execute('''SELECT question, user_answer, correct_answer, is_correct FROM quiz_results 
-                      WHERE username = ?''', (username,))
-    history = cursor.fetchall()
-    conn.close()
-    return history
-
-@st.cache_data
-def fetch_questions(text_content, quiz_level):
-    RESPONSE_JSON = {
-        "mcqs": [
-            {
-                "mcq": "multiple choice question1",
-                "options": {
-                    "a": "choice here1",
-                    "b": "choice here2",
-                    "c": "choice here3",
-                    "d": "choice here4",
-                },
-                "correct": "correct choice option in the form of a, b, c or d",
-            },
-            {
-                "mcq": "multiple choice question",
-                "options": {
-                    "a": "choice here",
-                    "b": "choice here",
-                    "c": "choice here",
-                    "d": "choice here",
-                },
-                "correct": "correct choice option in the form of a, b, c or d",
-            }
-        ]
-    }
-
-    PROMPT_TEMPLATE = """
-    Text: {text_content}
-    You are an expert in generating MCQ type quiz on the basis of provided content. 
-    Given the above text, create a quiz of 5 multiple choice questions keeping difficulty level as {quiz_level}. 
-    Make sure the questions are not repeated and check all the questions to be conforming the text as well.
-    Make sure to format your response like RESPONSE_JSON below and use it as a guide.
-    Ensure to make an array of 5 MCQs referring the following response json.
-    Here is the RESPONSE_JSON: 
-
-    {RESPONSE_JSON}
-    """
-
-    formatted_template = PROMPT_TEMPLATE.format(text_content=text_content, quiz_level=quiz_level, RESPONSE_JSON=RESPONSE_JSON)
-    generation_config = {
-        "temperature": 1,
-        "top_p": 0.95,
-        "top_k": 40,
-        "max_output_tokens": 8192,
-        "response_mime_type": "application/json",
+STREAMING = os.getenv("QUIZ_STREAMING", "1") == "1"
+
+# Generation runs on a shared background event loop that coalesces identical
+# requests, rate-limits Gemini calls and caches results in the database.
+@metrics.timed("fetch_questions_seconds")
+def fetch_questions(text_content, quiz_level, fresh=False):
+    return get_service().generate(text_content, quiz_level, fresh=fresh)
+
+# Yields questions one by one while the model is still writing the rest
+def stream_questions(text_content, quiz_level, fresh=False):
+    return get_service().generate_stream(text_content, quiz_level, fresh)
+
+# Generate a quiz into st.session_state.quiz. Streamed questions are rendered
+# as they arrive; later reruns render the stored quiz instead of generating.
+# The quiz only counts once generation finished ('complete'): a rerun or stop
+# in the middle raises a Streamlit control-flow exception that is not an
+# Exception, and the partial quiz it leaves behind is discarded on the next run.
+def start_quiz(text_content, quiz_level, quiz_size):
+    quiz = {
+        'id': uuid.uuid4().hex,
+        'level': quiz_level,
+        'questions': [],
+        'result': None,
+        'complete': False,
     }
+    st.session_state.quiz = quiz
+
+    start = time.perf_counter()
+    username = st.session_state.username
+    long_document = estimate_tokens(text_content) > CHUNK_MAX_TOKENS
+    banked = None if long_document else sample_questions(username, text_content, quiz_level)
+    # The cached quiz for this text (or a near-duplicate of it) holds the
+    # banked questions the user has already answered, so generate new ones
+    # instead of serving it again
+    texts = split_text(text_content) if long_document else [text_content]
+    fresh = banked is None and has_answered(
+        username, texts, quiz_level, get_service().near_duplicate_sources(texts))
+    if banked is not None:
+        source, incoming = 'bank', banked
+    elif long_document:
+        source, incoming = 'document', generate_document(get_service(), text_content, quiz_level, quiz_size,
+                                                         fresh=fresh)
+    elif STREAMING:
+        source, incoming = 'stream', stream_questions(text_content=text_content, quiz_level=quiz_level, fresh=fresh)
+    else:
+        source, incoming = 'generate', fetch_questions(text_content=text_content, quiz_level=quiz_level, fresh=fresh)
+    metrics.inc("quizzes_started_total", source=source)
 
-    model = genai.GenerativeModel(
-        model_name="gemini-1.5-flash",
-        generation_config=generation_config,
-    )
-
-    chat_session = model.start_chat(
-        history=[
-            {
-                "role": "user",
-                "parts": [
-                    "TEXT:\nArtificial intelligence (AI), in its broadest sense, is intelligence exhibited by machines, particularly computer systems. It is a field of research in computer science that develops and studies methods and software that enable machines to perceive their environment and use learning and intelligence to take actions that maximize their chances of achieving defined goals.[1] Such machines may be called AIs.\n\nSome high-profile applications of AI include advanced web search engines (e.g., Google Search); recommendation systems (used by YouTube, Amazon, and Netflix); interacting via human speech (e.g., Google Assistant, Siri, and Alexa); autonomous vehicles (e.g., Waymo); generative and creative tools (e.g., ChatGPT, and AI art); and superhuman play and analysis in strategy games (e.g., chess and Go). However, many AI applications are not perceived as AI: \"A lot of cutting edge AI has filtered into general applications, often without being called AI because once something becomes useful enough and common enough it's not labeled AI anymore.\"[2][3]\n\nThe various subfields of AI research are centered around particular goals and the use of particular tools. The traditional goals of AI research include reasoning, knowledge representation, planning, learning, natural language processing, perception, and support for robotics.[a] General intelligence—the ability to complete any task performable by a human on an at least equal level—is among the field's long-term goals.[4] To reach these goals, AI researchers have adapted and integrated a wide range of techniques, including search and mathematical optimization, formal logic, artificial neural networks, and methods based on statistics, operations research, and economics.[b] AI also draws upon psychology, linguistics, philosophy, neuroscience, and other fields.[5]\n\nYou are an expert in generating MCQ type quiz on the basis of provided content. \n    Given the above text, create a quiz of 3 multiple choice questions keeping difficulty level as {quiz_level}. \n    Make sure the questions are not repeated and check all the questions to be conforming the text as well.\n    Make sure to format your response like RESPONSE_JSON below and use it as a guide.\n    Ensure to make an array of 3 MCQs referring the following response json.\n    Here is the RESPONSE_JSON: \n{\"mcqs\": [\n            {\n                \"mcq\": \"multiple choice question1\",\n                \"options\": {\n                    \"a\": \"choice here1\",\n                    \"b\": \"choice here2\",\n                    \"c\": \"choice here3\",\n                    \"d\": \"choice here4\",\n                },\n                \"correct\": \"correct choice option in the form of a, b, c or d\",\n            },\n            {\n                \"mcq\": \"multiple choice question\",\n                \"options\": {\n                    \"a\": \"choice here\",\n                    \"b\": \"choice here\",\n                    \"c\": \"choice here\",\n                    \"d\": \"choice here\",\n                },\n                \"correct\": \"correct choice option in the form of a, b, c or d\",\n            },\n            {\n                \"mcq\": \"multiple choice question\",\n                \"options\": {\n                    \"a\": \"choice here\",\n                    \"b\": \"choice here\",\n                    \"c\": \"choice here\",\n                    \"d\": \"choice here\",\n                },\n                \"correct\": \"correct choice option in the form of a, b, c or d\",\n            }\n        ]\n}",
-                ],
-            },
-            {
-                "role": "model",
-                "parts": [
-                    "```json\n{\"mcqs\": [{\"mcq\": \"What is the broad definition of Artificial Intelligence (AI)?\", \"options\": {\"a\": \"Intelligence demonstrated by animals and humans.\", \"b\": \"Intelligence displayed by machines, especially computer systems.\", \"c\": \"The study of human intelligence and behavior.\", \"d\": \"The development of advanced computer hardware.\"}, \"correct\": \"b\"}, {\"mcq\": \"Which of the following is NOT mentioned as a high-profile application of AI in the text?\", \"options\": {\"a\": \"Advanced web search engines like Google Search.\", \"b\": \"Recommendation systems used by platforms like YouTube and Netflix.\", \"c\": \"Developing new medical treatments and cures.\", \"d\": \"Generative and creative tools like ChatGPT and AI art.\"}, \"correct\": \"c\"}, {\"mcq\": \"What is considered a long-term goal in the field of AI research?\", \"options\": {\"a\": \"Creating AI that can perform specific tasks better than humans.\", \"b\": \"Developing AI that can play strategic games like chess and Go.\", \"c\": \"Achieving general intelligence, enabling AI to complete any task a human can.\", \"d\": \"Improving the efficiency of existing AI algorithms.\"}, \"correct\": \"c\"}]}\n```",
-                ],
-            },
-        ]
-    )
-
-    response = chat_session.send_message(formatted_template)
-    extracted_response = response.text
-    return json.loads(extracted_response).get("mcqs", [])
+    try:
+        for question in incoming:
+            if not quiz['questions']:
+                # What the user waits for before there is anything to read
+                metrics.observe("quiz_first_question_seconds", time.perf_counter() - start, source=source)
+            quiz['questions'].append(question)
+            question_fragment(quiz['id'], len(quiz['questions']) - 1)
+    except Exception:
+        st.session_state.quiz = None
+        metrics.inc("quiz_generation_errors_total", source=source)
+        raise
+    metrics.observe("quiz_ready_seconds", time.perf_counter() - start, source=source)
+    if not quiz['questions']:
+        st.session_state.quiz = None
+        st.error("No questions could be generated from this text. Please try again or use a different text.")
+        return
+    quiz['complete'] = True
+    quiz_footer(quiz)
+
+# One question per fragment: picking an answer reruns only this widget
+@st.fragment
+def question_fragment(quiz_id, index):
+    question = st.session_state.quiz['questions'][index]
+    disabled = st.session_state.quiz['result'] is not None
+    st.radio(question["mcq"], list(question["options"].values()), index=None,
+             key=f"answer_{quiz_id}_{index}", disabled=disabled)
+
+def quiz_footer(quiz):
+    if not quiz['complete'] or not quiz['questions']:
+        return
+    if quiz['result'] is None and st.button("Submit", key=f"submit_{quiz['id']}"):
+        answers = [st.session_state.get(f"answer_{quiz['id']}_{i}") for i in range(len(quiz['questions']))]
+        if None in answers:
+            st.warning("Please answer every question before submitting.")
+            return
+        results = []
+        for question, selected_option in zip(quiz['questions'], answers):
+            correct_option = question["options"][question["correct"]]
+            results.append((question['mcq'], selected_option, correct_option, selected_option == correct_option))
+        # One transaction for the whole attempt
+        submit_quiz_attempt(st.session_state.username, quiz['level'], results)
+        quiz['result'] = results
+        st.rerun()
+
+    if quiz['result'] is not None:
+        marks = sum(1 for result in quiz['result'] if result[3])
+        st.header("Quiz Result:")
+        st.table([{
+            "Question": question,
+            "You selected": selected_option,
+            "Correct answer": correct_option,
+        } for question, selected_option, correct_option, _ in quiz['result']])
+        st.subheader(f"You scored {marks} out of {len(quiz['result'])}")
+
+# Curated topics change rarely; don't re-read the file on every rerun
+@st.cache_data(ttl=300)
+def curated_topics():
+    return load_topics()
+
+# With QUIZ_PROFILING=1, opening the app with ?profile=1 samples this
+# session's script runs; the previous run's hottest functions are shown in
+# the sidebar.
+@contextmanager
+def session_profiler():
+    if metrics.PROFILING and st.query_params.get("profile") == "1":
+        st.session_state.profiling = True
+    if not st.session_state.get('profiling'):
+        yield
+        return
+    report = st.session_state.get('profile_report')
+    if report:
+        with st.sidebar.expander("Profile of the previous run", expanded=False):
+            st.table([{"Function": function, "On stack": f"{inclusive:.0%}", "Running": f"{own:.0%}"}
+                      for function, inclusive, own in report['top']])
+            st.download_button("Folded stacks", report['folded'], file_name="profile.folded")
+    profiler = metrics.SamplingProfiler()
+    try:
+        with profiler:
+            yield
+    finally:
+        st.session_state.profile_report = {'top': profiler.top(), 'folded': profiler.folded()}
 
 def main():
     init_db()
+    metrics.start_exporters()
+    if BANK_WARMUP:
+        start_warmup(get_service(), curated_topics())
 
     st.title("Quiz Generator App")
 
     # Separate pages for authentication
     if 'page' not in st.session_state:
         st.session_state.page = 'login'
+    elif st.session_state.page not in ('login', 'signup'):
+        # The signed session token is checked on every rerun without a DB lookup
+        if verify_token(st.session_state.get('session_token')) != st.session_state.get('username'):
+            logout()
 
+    with session_profiler(), metrics.timed("page_render_seconds", page=st.session_state.page):
+        render_page()
+
+def render_page():
     # Authentication
     if st.session_state.page == 'login':
         st.header("Login")
@@ -162,14 +172,16 @@ def main():
             if authenticate(username, password):
                 st.session_state.authenticated = True
                 st.session_state.username = username
+                st.session_state.session_token = issue_token(username)
                 st.session_state.page = 'home'
-                st.success("Login successful!")
+                st.rerun()
             else:
                 st.error("Invalid username or password")
 
         # Link to signup page
         if st.button("Signup"):
             st.session_state.page = 'signup'
+            st.rerun()
 
     elif st.session_state.page == 'signup':
         st.header("Signup")
@@ -186,77 +198,95 @@ def main():
         # Link back to login page
         if st.button("Back to Login"):
             st.session_state.page = 'login'
+            st.rerun()
 
     elif st.session_state.page == 'home':
         st.header(f"Welcome, {st.session_state.username}!")
         if st.button("Logout"):
             logout()
+            st.rerun()
 
         # History Section
         if st.button("View Quiz History"):
+            st.session_state.history_cursors = [None]
             st.session_state.page = 'history'
+            st.rerun()
 
         # Quiz functionality
-        text_content = st.text_area("Paste the text content here:")
+        topics = curated_topics()
+        topic_titles = [topic["title"] for topic in topics]
+        topic = st.selectbox("Pick a curated topic or paste your own text:", ["Custom text"] + topic_titles)
+        if topic == "Custom text":
+            text_content = st.text_area("Paste the text content here:")
+        else:
+            text_content = topics[topic_titles.index(topic)]["text"]
         quiz_level = st.selectbox("Select quiz level:", ["Easy", "Medium", "Hard"])
-
-        if st.button("Generate Quiz"):
-            if text_content:
-                questions = fetch_questions(text_content=text_content, quiz_level=quiz_level.lower())
-
-                selected_options = []
-                correct_answers = []
-
-                for question in questions:
-                    options = list(question["options"].values())
-                    selected_option = st.radio(question["mcq"], options, index=None)
-                    selected_options.append(selected_option)
-                    correct_answers.append(question["options"][question["correct"]])
-
-                if st.button("Submit"):
-                    marks = 0
-                    st.header("Quiz Result:")
-                    for i, question in enumerate(questions):
-                        selected_option = selected_options[i]
-                        correct_option = correct_answers[i]
-                        st.subheader(f"{question['mcq']}")
-                        st.write(f"You selected: {selected_option}")
-                        st.write(f"Correct answer: {correct_option}")
-
-                        is_correct = selected_option == correct_option
-                        if is_correct:
-                            marks += 1
-
-                        save_quiz_result(
-                            st.session_state.username,
-                            question['mcq'],
-                            selected_option,
-                            correct_option,
-                            is_correct
-                        )
-
-                    st.subheader(f"You scored {marks} out of {len(questions)}")
+        quiz_size = 5
+        if estimate_tokens(text_content) > CHUNK_MAX_TOKENS:
+            # Long documents are split into chunks, so more questions are available
+            quiz_size = st.slider("Number of questions:", 5, 30, 10)
+
+        if st.button("Generate Quiz") and text_content:
+            start_quiz(text_content, quiz_level.lower(), quiz_size)
+        elif st.session_state.get('quiz') is not None and not st.session_state.quiz['complete']:
+            # Generation was interrupted by a rerun; never show a partial quiz
+            st.session_state.quiz = None
+        elif st.session_state.get('quiz') is not None:
+            quiz = st.session_state.quiz
+            for index in range(len(quiz['questions'])):
+                question_fragment(quiz['id'], index)
+            quiz_footer(quiz)
 
     elif st.session_state.page == 'history':
         st.header("Your Quiz History")
-        history = fetch_quiz_history(st.session_state.username)
+        stats = fetch_user_stats(st.session_state.username)
+
+        # Rows with nothing answered (left by older versions) would divide by zero
+        by_level = [row for row in stats["by_level"] if row[1]]
+        by_day = [row for row in stats["by_day"] if row[1]]
+        if by_level:
+            columns = st.columns(len(by_level))
+            for column, (level, answered, correct) in zip(columns, by_level):
+                column.metric(level.capitalize(), f"{correct / answered:.0%}", f"{answered} answered", delta_color="off")
+        if by_day:
+            st.line_chart({
+                "day": [day for day, _, _ in by_day],
+                "accuracy": [correct / answered for _, answered, correct in by_day],
+            }, x="day", y="accuracy")
+
+        # Keyset pagination: each entry is the `before_id` that produced a page
+        if 'history_cursors' not in st.session_state:
+            st.session_state.history_cursors = [None]
+        history, next_before = fetch_quiz_history_page(
+            st.session_state.username, st.session_state.history_cursors[-1])
 
         if history:
-            for record in history:
-                question, user_answer, correct_answer, is_correct = record
-                st.write(f"**Question:** {question}")
-                st.write(f"**Your Answer:** {user_answer}")
-                st.write(f"**Correct Answer:** {correct_answer}")
-                st.write(f"**Result:** {'Correct' if is_correct else 'Incorrect'}")
-                st.write("---")
+            st.table([{
+                "Question": question,
+                "Your Answer": user_answer,
+                "Correct Answer": correct_answer,
+                "Result": 'Correct' if is_correct else 'Incorrect',
+            } for question, user_answer, correct_answer, is_correct in history])
+
+        newer, older = st.columns(2)
+        if len(st.session_state.history_cursors) > 1 and newer.button("Newer"):
+            st.session_state.history_cursors.pop()
+            st.rerun()
+        if next_before is not None and older.button("Older"):
+            st.session_state.history_cursors.append(next_before)
+            st.rerun()
 
         # Back button to home
         if st.button("Back to Home"):
+            st.session_state.history_cursors = [None]
             st.session_state.page = 'home'
+            st.rerun()
 
 def logout():
     st.session_state.authenticated = False
     st.session_state.username = None
+    st.session_state.session_token = None
+    st.session_state.quiz = None
     st.session_state.page = 'login'
     # st.experimental_rerun()
 
@@ -0,0 +1,586 @@
+import atexit
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+import metrics
+
+DB_PATH = os.getenv("QUIZ_DB_PATH", "quiz_app.db")
+POOL_SIZE = int(os.getenv("QUIZ_DB_POOL_SIZE", "8"))
+WRITE_BEHIND = os.getenv("QUIZ_WRITE_BEHIND", "0") == "1"
+# Longest the process waits at exit for queued write-behind attempts
+EXIT_FLUSH_TIMEOUT = 10.0
+HISTORY_PAGE_SIZE = 20
+# Level recorded for answers saved without a parent attempt
+UNKNOWN_LEVEL = "unknown"
+
+logger = logging.getLogger(__name__)
+
+# Pragmas applied to every pooled connection. WAL lets readers run alongside a
+# writer, synchronous=NORMAL only fsyncs at checkpoints instead of every commit,
+# and busy_timeout makes writers wait for the lock instead of failing with
+# "database is locked".
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-16000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA busy_timeout=5000",
+)
+
+
+class ConnectionPool:
+    """Fixed-size, thread-safe pool of SQLite connections to one database file."""
+
+    def __init__(self, path=DB_PATH, size=POOL_SIZE, timeout=30.0):
+        self.path = path
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue(maxsize=size)
+        self._created = 0
+        self._lock = threading.Lock()
+        self._closed = False
+        # Number of connections handed out, and how often/long callers had to
+        # wait for one, for benchmarks (approximate under contention)
+        self.checkouts = 0
+        self.waits = 0
+        self.wait_seconds = 0.0
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=self.timeout, check_same_thread=False)
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def _acquire(self):
+        if self._closed:
+            raise RuntimeError("connection pool is closed")
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                try:
+                    return self._connect()
+                except Exception:
+                    self._created -= 1
+                    raise
+        start = time.perf_counter()
+        try:
+            conn = self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            # Callers handle database errors, not queue internals
+            raise sqlite3.OperationalError("timed out waiting for a pooled connection") from None
+        self.waits += 1
+        self.wait_seconds += time.perf_counter() - start
+        return conn
+
+    def _release(self, conn):
+        if self._closed:
+            conn.close()
+            return
+        self._idle.put_nowait(conn)
+
+    # Borrow a connection for the duration of the block.
+    @contextmanager
+    def connection(self):
+        conn = self._acquire()
+        self.checkouts += 1
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            self._release(conn)
+
+    # Borrow a connection and run the block as one transaction.
+    @contextmanager
+    def transaction(self):
+        with self.connection() as conn:
+            try:
+                yield conn
+            except BaseException:
+                conn.rollback()
+                raise
+            else:
+                conn.commit()
+
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+_pool = None
+_pool_lock = threading.Lock()
+_schema_ready = set()
+
+
+# Process-wide pool. Streamlit reruns re-execute the script but keep imported
+# modules, so every session in this process shares the same connections.
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool()
+    return _pool
+
+
+def _pool_gauges():
+    pool = get_pool()
+    return {"connections": pool._created, "checkouts": pool.checkouts, "waits": pool.waits,
+            "wait_seconds": pool.wait_seconds}
+
+
+metrics.register_gauges("db_pool", _pool_gauges)
+
+
+def configure(path=DB_PATH, size=POOL_SIZE):
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+        _pool = ConnectionPool(path, size)
+    return _pool
+
+
+# Point the process-wide pool at another database for the duration of the
+# block (benchmarks, load tests), then close it and restore the previous pool.
+@contextmanager
+def temporary_pool(path, size=POOL_SIZE):
+    global _pool
+    pool = ConnectionPool(path, size)
+    with _pool_lock:
+        previous, _pool = _pool, pool
+    try:
+        yield pool
+    finally:
+        with _pool_lock:
+            _pool = previous
+        pool.close()
+
+
+def _create_schema(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS users (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        username TEXT UNIQUE NOT NULL,
+                        password TEXT NOT NULL
+                      )''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS quiz_results (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        username TEXT NOT NULL,
+                        question TEXT NOT NULL,
+                        user_answer TEXT NOT NULL,
+                        correct_answer TEXT NOT NULL,
+                        is_correct BOOLEAN NOT NULL
+                      )''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS quiz_attempts (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        username TEXT NOT NULL,
+                        level TEXT NOT NULL,
+                        score INTEGER NOT NULL,
+                        total INTEGER NOT NULL,
+                        created_at REAL NOT NULL
+                      )''')
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(quiz_results)")}
+    if "attempt_id" not in columns:
+        conn.execute("ALTER TABLE quiz_results ADD COLUMN attempt_id INTEGER REFERENCES quiz_attempts(id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_quiz_results_username_id ON quiz_results (username, id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_quiz_attempts_username_id ON quiz_attempts (username, id)")
+
+    # Per-user aggregates, maintained incrementally by every write so the
+    # history page never has to scan a user's answers.
+    existing = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    conn.execute('''CREATE TABLE IF NOT EXISTS user_level_stats (
+                        username TEXT NOT NULL,
+                        level TEXT NOT NULL,
+                        answered INTEGER NOT NULL,
+                        correct INTEGER NOT NULL,
+                        PRIMARY KEY (username, level)
+                      ) WITHOUT ROWID''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS user_daily_stats (
+                        username TEXT NOT NULL,
+                        day TEXT NOT NULL,
+                        answered INTEGER NOT NULL,
+                        correct INTEGER NOT NULL,
+                        PRIMARY KEY (username, day)
+                      ) WITHOUT ROWID''')
+    # Generated quizzes keyed by a content hash, shared by every worker
+    conn.execute('''CREATE TABLE IF NOT EXISTS quiz_cache (
+                        key TEXT PRIMARY KEY,
+                        payload TEXT NOT NULL,
+                        size INTEGER NOT NULL,
+                        created_at REAL NOT NULL,
+                        last_access REAL NOT NULL,
+                        hits INTEGER NOT NULL DEFAULT 0
+                      ) WITHOUT ROWID''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_quiz_cache_last_access ON quiz_cache (last_access)")
+    # Individual generated questions, sampled to serve quizzes without a model call
+    conn.execute('''CREATE TABLE IF NOT EXISTS question_bank (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        source_hash TEXT NOT NULL,
+                        level TEXT NOT NULL,
+                        mcq TEXT NOT NULL,
+                        options TEXT NOT NULL,
+                        correct TEXT NOT NULL,
+                        flags INTEGER NOT NULL,
+                        created_at REAL NOT NULL,
+                        UNIQUE (source_hash, level, mcq)
+                      )''')
+    # MinHash signatures of submitted texts, for near-duplicate lookup
+    conn.execute('''CREATE TABLE IF NOT EXISTS text_fingerprints (
+                        digest TEXT NOT NULL UNIQUE,
+                        signature BLOB NOT NULL,
+                        created_at REAL NOT NULL
+                      )''')
+    # Archives loaded by analytics.import_results, so loading one twice is refused
+    conn.execute('''CREATE TABLE IF NOT EXISTS imported_archives (
+                        id TEXT PRIMARY KEY,
+                        rows INTEGER NOT NULL,
+                        imported_at REAL NOT NULL
+                      ) WITHOUT ROWID''')
+    if "user_level_stats" not in existing:
+        conn.execute('''INSERT INTO user_level_stats (username, level, answered, correct)
+                        SELECT r.username, COALESCE(a.level, ?), COUNT(*), SUM(r.is_correct)
+                        FROM quiz_results r LEFT JOIN quiz_attempts a ON a.id = r.attempt_id
+                        GROUP BY 1, 2''', (UNKNOWN_LEVEL,))
+    if "user_daily_stats" not in existing:
+        conn.execute('''INSERT INTO user_daily_stats (username, day, answered, correct)
+                        SELECT r.username, date(a.created_at, 'unixepoch'), COUNT(*), SUM(r.is_correct)
+                        FROM quiz_results r JOIN quiz_attempts a ON a.id = r.attempt_id
+                        GROUP BY 1, 2''')
+
+
+# Initialize SQLite database (once per process and database file)
+def init_db():
+    pool = get_pool()
+    if pool.path in _schema_ready:
+        return
+    with _pool_lock:
+        if pool.path in _schema_ready:
+            return
+        with pool.transaction() as conn:
+            _create_schema(conn)
+        _schema_ready.add(pool.path)
+
+
+# Stored password hash for a user, or None if the user does not exist
+@metrics.timed("db_query_seconds")
+def fetch_password_hash(username):
+    with get_pool().connection() as conn:
+        row = conn.execute("SELECT password FROM users WHERE username = ?", (username,)).fetchone()
+    return row[0] if row else None
+
+
+# Create a user; False if the username is taken
+@metrics.timed("db_query_seconds")
+def create_user(username, password_hash):
+    try:
+        with get_pool().transaction() as conn:
+            conn.execute("INSERT INTO users (username, password) VALUES (?, ?)", (username, password_hash))
+    except sqlite3.IntegrityError:
+        return False
+    return True
+
+
+@metrics.timed("db_query_seconds")
+def update_password_hash(username, password_hash):
+    with get_pool().transaction() as conn:
+        conn.execute("UPDATE users SET password = ? WHERE username = ?", (password_hash, username))
+
+
+# Save quiz result
+@metrics.timed("db_query_seconds")
+def save_quiz_result(username, question, user_answer, correct_answer, is_correct):
+    with get_pool().transaction() as conn:
+        conn.execute('''INSERT INTO quiz_results (username, question, user_answer, correct_answer, is_correct)
+                        VALUES (?, ?, ?, ?, ?)''', (username, question, user_answer, correct_answer, is_correct))
+        _update_stats(conn, username, UNKNOWN_LEVEL, None, 1, int(bool(is_correct)))
+
+
+# Load an exported archive (used by analytics.import_results) in a single
+# transaction, so a failure part way leaves nothing behind. `batches` yields
+# (attempts, answers) pairs: attempts are (username, level, results,
+# created_at, score, total) and answers (username, question, user_answer,
+# correct_answer, is_correct) saved without an attempt. Raises ValueError if
+# `archive_id` was imported before; returns the number of answers.
+def import_quiz_results(archive_id, batches):
+    with get_pool().transaction() as conn:
+        if conn.execute("SELECT 1 FROM imported_archives WHERE id = ?", (archive_id,)).fetchone():
+            raise ValueError(f"archive {archive_id} was already imported")
+        rows = 0
+        for attempts, answers in batches:
+            for username, level, results, created_at, score, total in attempts:
+                _insert_attempt(conn, username, level, results, created_at, score, total)
+                rows += len(results)
+            for username, question, user_answer, correct_answer, is_correct in answers:
+                conn.execute('''INSERT INTO quiz_results (username, question, user_answer, correct_answer, is_correct)
+                                VALUES (?, ?, ?, ?, ?)''', (username, question, user_answer, correct_answer, is_correct))
+                _update_stats(conn, username, UNKNOWN_LEVEL, None, 1, int(bool(is_correct)))
+            rows += len(answers)
+        conn.execute("INSERT INTO imported_archives (id, rows, imported_at) VALUES (?, ?, ?)",
+                     (archive_id, rows, time.time()))
+    return rows
+
+
+def _update_stats(conn, username, level, day, answered, correct):
+    conn.execute('''INSERT INTO user_level_stats (username, level, answered, correct) VALUES (?, ?, ?, ?)
+                    ON CONFLICT (username, level) DO UPDATE SET
+                        answered = answered + excluded.answered,
+                        correct = correct + excluded.correct''', (username, level, answered, correct))
+    if day is not None:
+        conn.execute('''INSERT INTO user_daily_stats (username, day, answered, correct) VALUES (?, ?, ?, ?)
+                        ON CONFLICT (username, day) DO UPDATE SET
+                            answered = answered + excluded.answered,
+                            correct = correct + excluded.correct''', (username, day, answered, correct))
+
+
+def _check_attempt(results):
+    # An empty attempt would create stats rows with answered = 0
+    if not results:
+        raise ValueError("a quiz attempt needs at least one answer")
+
+
+# `score` and `total` default to the counts in `results`; imported attempts
+# keep the ones they were exported with
+def _insert_attempt(conn, username, level, results, created_at, score=None, total=None):
+    _check_attempt(results)
+    correct = sum(1 for result in results if result[3])
+    cursor = conn.execute('''INSERT INTO quiz_attempts (username, level, score, total, created_at)
+                             VALUES (?, ?, ?, ?, ?)''',
+                          (username, level, correct if score is None else score,
+                           len(results) if total is None else total, created_at))
+    attempt_id = cursor.lastrowid
+    conn.executemany('''INSERT INTO quiz_results
+                          (username, question, user_answer, correct_answer, is_correct, attempt_id)
+                          VALUES (?, ?, ?, ?, ?, ?)''',
+                     [(username, question, user_answer, correct_answer, is_correct, attempt_id)
+                      for question, user_answer, correct_answer, is_correct in results])
+    day = time.strftime("%Y-%m-%d", time.gmtime(created_at))
+    _update_stats(conn, username, level, day, len(results), correct)
+    return attempt_id
+
+
+# Save a whole quiz attempt in one transaction. `results` is a sequence of
+# (question, user_answer, correct_answer, is_correct) tuples.
+@metrics.timed("db_query_seconds")
+def save_quiz_attempt(username, level, results, created_at=None):
+    results = list(results)
+    _check_attempt(results)
+    with get_pool().transaction() as conn:
+        return _insert_attempt(conn, username, level, results,
+                               time.time() if created_at is None else created_at)
+
+
+class WriteBehindQueue:
+    """Background writer that commits queued quiz attempts in grouped transactions."""
+
+    def __init__(self, max_batch=64, max_delay=0.05):
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="quiz-write-behind", daemon=True)
+        self._thread.start()
+        # The writer is a daemon thread; write what is queued before the
+        # interpreter exits instead of losing it (but never hang the exit)
+        atexit.register(self.flush, EXIT_FLUSH_TIMEOUT)
+
+    def submit(self, username, level, results):
+        results = list(results)
+        _check_attempt(results)
+        self._queue.put((username, level, results, time.time()))
+
+    # Block until everything submitted so far has been written, or `timeout`
+    # seconds passed, or the writer thread died. Returns whether it was written.
+    def flush(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = 0.1 if deadline is None else min(0.1, deadline - time.monotonic())
+                if remaining <= 0 or not self._thread.is_alive():
+                    return False
+                self._queue.all_tasks_done.wait(remaining)
+        return True
+
+    def _drain(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._drain()
+            try:
+                self._write(batch)
+            except Exception:
+                logger.exception("dropping %d quiz attempts", len(batch))
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _write(self, batch):
+        try:
+            with get_pool().transaction() as conn:
+                for attempt in batch:
+                    _insert_attempt(conn, *attempt)
+            return
+        except Exception:
+            # Anything escaping here would kill the writer thread
+            logger.exception("grouped commit of %d attempts failed, retrying one by one", len(batch))
+        for attempt in batch:
+            try:
+                with get_pool().transaction() as conn:
+                    _insert_attempt(conn, *attempt)
+            except Exception:
+                logger.exception("dropping quiz attempt for %s", attempt[0])
+
+
+_writer = None
+
+
+def get_writer():
+    global _writer
+    if _writer is None:
+        with _pool_lock:
+            if _writer is None:
+                _writer = WriteBehindQueue()
+    return _writer
+
+
+# Record a submitted quiz, either synchronously or through the write-behind
+# queue when QUIZ_WRITE_BEHIND=1. Queued attempts are written within
+# max_delay, so a history read right after submitting may not include them yet.
+def submit_quiz_attempt(username, level, results):
+    if WRITE_BEHIND:
+        get_writer().submit(username, level, results)
+    else:
+        save_quiz_attempt(username, level, results)
+
+
+# Fetch quiz history
+@metrics.timed("db_query_seconds")
+def fetch_quiz_history(username):
+    with get_pool().connection() as conn:
+        return conn.execute('''SELECT question, user_answer, correct_answer, is_correct FROM quiz_results
+                               WHERE username = ?''', (username,)).fetchall()
+
+
+# One page of a user's answers, newest first. Pass the `next_before` value of
+# the previous page as `before_id` to continue; the index on (username, id)
+# keeps each page an index range scan regardless of how much history exists.
+@metrics.timed("db_query_seconds")
+def fetch_quiz_history_page(username, before_id=None, limit=HISTORY_PAGE_SIZE):
+    with get_pool().connection() as conn:
+        if before_id is None:
+            rows = conn.execute('''SELECT id, question, user_answer, correct_answer, is_correct FROM quiz_results
+                                    WHERE username = ? ORDER BY id DESC LIMIT ?''', (username, limit)).fetchall()
+        else:
+            rows = conn.execute('''SELECT id, question, user_answer, correct_answer, is_correct FROM quiz_results
+                                    WHERE username = ? AND id < ? ORDER BY id DESC LIMIT ?''',
+                                (username, before_id, limit)).fetchall()
+    next_before = rows[-1][0] if len(rows) == limit else None
+    return [row[1:] for row in rows], next_before
+
+
+# Precomputed accuracy for a user: totals per level and per day (most recent
+# `days` days), as (key, answered, correct) tuples.
+@metrics.timed("db_query_seconds")
+def fetch_user_stats(username, days=30):
+    with get_pool().connection() as conn:
+        by_level = conn.execute('''SELECT level, answered, correct FROM user_level_stats
+                                   WHERE username = ? ORDER BY level''', (username,)).fetchall()
+        by_day = conn.execute('''SELECT day, answered, correct FROM user_daily_stats
+                                 WHERE username = ? ORDER BY day DESC LIMIT ?''', (username, days)).fetchall()
+    return {"by_level": by_level, "by_day": by_day[::-1]}
+
+
+# Benchmark: N simulated sessions each signing up once, then alternating login
+# lookups and quiz submissions against a scratch database. Password hashing is
+# left out (see auth.py for end-to-end login throughput).
+def benchmark(sessions=8, operations=200, path=None, questions=5, write_behind=False):
+    import tempfile
+
+    tmpdir = None
+    if path is None:
+        tmpdir = tempfile.TemporaryDirectory()
+        path = os.path.join(tmpdir.name, "bench.db")
+    with temporary_pool(path, size=max(sessions, 1)):
+        init_db()
+
+        counts = {"login": 0, "write": 0}
+        counts_lock = threading.Lock()
+        errors = []
+
+        def session(n):
+            username = f"user{n}"
+            create_user(username, "hash")
+            local_counts = {"login": 0, "write": 0}
+            try:
+                for i in range(operations):
+                    fetch_password_hash(username)
+                    local_counts["login"] += 1
+                    results = [(f"question {i}.{q}", "a", "b", False) for q in range(questions)]
+                    if write_behind:
+                        get_writer().submit(username, "easy", results)
+                    else:
+                        save_quiz_attempt(username, "easy", results)
+                    local_counts["write"] += questions
+            except sqlite3.Error as exc:
+                errors.append(exc)
+            with counts_lock:
+                for key in counts:
+                    counts[key] += local_counts[key]
+
+        threads = [threading.Thread(target=session, args=(n,)) for n in range(sessions)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if write_behind:
+            get_writer().flush()
+        wall = time.perf_counter() - start
+
+    if tmpdir is not None:
+        tmpdir.cleanup()
+    return {
+        "sessions": sessions,
+        "wall_seconds": wall,
+        "logins_per_second": counts["login"] / wall if wall else 0.0,
+        "writes_per_second": counts["write"] / wall if wall else 0.0,
+        "errors": len(errors),
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark the SQLite persistence layer")
+    parser.add_argument("--sessions", type=int, default=8)
+    parser.add_argument("--operations", type=int, default=200)
+    parser.add_argument("--questions", type=int, default=5, help="answers per submitted quiz")
+    parser.add_argument("--write-behind", action="store_true", help="submit through the write-behind queue")
+    parser.add_argument("--db", default=None, help="database file (defaults to a scratch file)")
+    args = parser.parse_args()
+    result = benchmark(args.sessions, args.operations, args.db, args.questions, args.write_behind)
+    print(f"sessions={result['sessions']} wall={result['wall_seconds']:.2f}s "
+          f"logins/s={result['logins_per_second']:.0f} writes/s={result['writes_per_second']:.0f} "
+          f"errors={result['errors']}")
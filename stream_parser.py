@@ -0,0 +1,150 @@
+import json
+
+
+class MCQStreamParser:
+    """Incremental parser for a streamed {"mcqs": [...]} response.
+
+    Feed it text chunks as they arrive; every `feed` returns the MCQ objects
+    that were completed by that chunk. Chunks may split anywhere, including
+    inside strings and escape sequences. Text before the top-level object,
+    such as a ```json fence, is ignored; items that are not valid JSON on
+    their own are skipped and counted in `malformed`.
+    """
+
+    def __init__(self, array_key="mcqs"):
+        self.array_key = array_key
+        self._buffer = []
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._string_start = None
+        self._last_key = None
+        self._in_array = False
+        self._item_start = None
+        self.count = 0
+        self.malformed = 0
+
+    def feed(self, chunk):
+        self._buffer.append(chunk)
+        text = "".join(self._buffer)
+        self._buffer = [text]
+        completed = []
+        for i in range(self._pos, len(text)):
+            char = text[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                    if self._depth == 1:
+                        self._last_key = text[self._string_start + 1:i]
+                continue
+            if char == '"':
+                self._in_string = True
+                self._string_start = i
+            elif char in "{[":
+                if char == "[" and self._depth == 1 and self._last_key == self.array_key:
+                    self._in_array = True
+                elif char == "{" and self._depth == 2 and self._in_array:
+                    self._item_start = i
+                self._depth += 1
+            elif char in "}]":
+                self._depth -= 1
+                if self._depth == 2 and self._item_start is not None:
+                    try:
+                        completed.append(json.loads(text[self._item_start:i + 1]))
+                    except json.JSONDecodeError:
+                        self.malformed += 1
+                    self._item_start = None
+                elif self._depth == 1 and self._in_array:
+                    self._in_array = False
+        self._pos = len(text)
+        # Drop consumed text that no pending item or key still refers to
+        keep_from = self._pos
+        if self._item_start is not None:
+            keep_from = self._item_start
+        if self._in_string and self._string_start is not None:
+            keep_from = min(keep_from, self._string_start)
+        if keep_from:
+            self._buffer = [text[keep_from:]]
+            self._pos -= keep_from
+            if self._item_start is not None:
+                self._item_start -= keep_from
+            if self._string_start is not None:
+                self._string_start -= keep_from
+        self.count += len(completed)
+        return completed
+
+
+# Parse a recorded chunk stream, returning the MCQs in arrival order
+def replay(chunks):
+    parser = MCQStreamParser()
+    mcqs = []
+    for chunk in chunks:
+        mcqs.extend(parser.feed(chunk))
+    return mcqs
+
+
+def _split(text, sizes):
+    chunks, start = [], 0
+    for size in sizes:
+        if start >= len(text):
+            break
+        chunks.append(text[start:start + size])
+        start += size
+    if start < len(text):
+        chunks.append(text[start:])
+    return chunks
+
+
+# Replay harness: recorded responses re-chunked at every offset (so every
+# string, escape and number is split mid-token at least once) and at random
+# sizes, checking the streamed MCQs match a one-shot json.loads.
+def check_replays(responses, random_rounds=200, seed=0):
+    import random
+
+    picker = random.Random(seed)
+    checked = 0
+    for response in responses:
+        body = response[response.index("{"):response.rindex("}") + 1]
+        expected = json.loads(body)["mcqs"]
+        splits = [[offset] for offset in range(1, len(response))]
+        splits += [[picker.randint(1, 12) for _ in range(len(response))] for _ in range(random_rounds)]
+        for sizes in splits:
+            chunks = _split(response, sizes)
+            got = replay(chunks)
+            if got != expected:
+                raise AssertionError(f"stream replay mismatch for chunk sizes {sizes[:10]}...")
+            checked += 1
+    return checked
+
+
+if __name__ == "__main__":
+    import asyncio
+    import time
+
+    import prompts
+    from backends import FakeBackend
+
+    recorded = [
+        prompts.LEGACY_FEW_SHOT_HISTORY[1]["parts"][0],
+        '{"mcqs": [{"mcq": "Escapes \\\\ \\"quoted\\" {braces} [brackets]?", '
+        '"options": {"a": "\\u00e9", "b": "x", "c": "y", "d": "z"}, "correct": "a"}, '
+        '{"mcq": "Second", "options": {"a": "1", "b": "2", "c": "3", "d": "4"}, "correct": "d"}]}',
+    ]
+    print(f"replayed {check_replays(recorded)} chunkings of {len(recorded)} recorded responses")
+
+    async def time_to_first(backend):
+        start = time.perf_counter()
+        first = None
+        parser = MCQStreamParser()
+        async for chunk in backend.stream(prompts.build_prompt("Benchmark text", "easy")):
+            if parser.feed(chunk) and first is None:
+                first = time.perf_counter() - start
+        return first, time.perf_counter() - start
+
+    first, total = asyncio.run(time_to_first(FakeBackend(latency=2.0, jitter=0.0, seed=0)))
+    print(f"fake backend: first question after {first:.2f}s, full response after {total:.2f}s")
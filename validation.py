@@ -0,0 +1,255 @@
+import json
+import re
+from dataclasses import dataclass
+
+from stream_parser import MCQStreamParser
+
+OPTION_KEYS = ("a", "b", "c", "d")
+
+_FENCE = re.compile(r"```(?:json|JSON)?\s*(.*?)(?:```|$)", re.DOTALL)
+# The whole answer must be a (decorated) key: "b", "B)", "(c)", "Option d."
+_CORRECT_KEY = re.compile(r"^\(?\s*(?:option\s+)?([a-d])\s*[).:]?\s*$", re.IGNORECASE)
+
+
+class InvalidMCQ(ValueError):
+    """Raised when a question cannot be turned into a usable MCQ."""
+
+
+@dataclass(frozen=True)
+class MCQ:
+    mcq: str
+    options: dict
+    correct: str
+
+    # Build from a model-produced dict, fixing the cheap, unambiguous mistakes
+    # (options as a list, upper-case or decorated answer keys, the answer given
+    # as option text) and rejecting everything else.
+    @classmethod
+    def from_dict(cls, data):
+        if not isinstance(data, dict):
+            raise InvalidMCQ("question is not an object")
+        question = str(data.get("mcq") or data.get("question") or "").strip()
+        if not question:
+            raise InvalidMCQ("missing question text")
+
+        options = data.get("options")
+        if isinstance(options, list):
+            options = dict(zip(OPTION_KEYS, options)) if len(options) == len(OPTION_KEYS) else None
+        if not isinstance(options, dict):
+            raise InvalidMCQ("options must be four choices")
+        options = {str(key).strip().lower(): str(value).strip() for key, value in options.items()}
+        if sorted(options) != list(OPTION_KEYS):
+            raise InvalidMCQ(f"expected options a-d, got {sorted(options)}")
+        if not all(options.values()) or len(set(options.values())) != len(options):
+            raise InvalidMCQ("options must be non-empty and distinct")
+
+        # Option text is matched first so answers like "A city in Italy" or
+        # "D. H. Lawrence" are not mistaken for a letter key
+        correct = str(data.get("correct") or data.get("answer") or "").strip()
+        by_text = [key for key, value in options.items() if value.lower() == correct.lower()]
+        match = _CORRECT_KEY.match(correct)
+        if len(by_text) == 1:
+            correct = by_text[0]
+        elif match:
+            correct = match.group(1).lower()
+        else:
+            raise InvalidMCQ(f"correct answer {correct!r} is not one of the options")
+        return cls(question, options, correct)
+
+    def to_dict(self):
+        return {"mcq": self.mcq, "options": dict(self.options), "correct": self.correct}
+
+
+def strip_fences(text):
+    match = _FENCE.search(text)
+    return match.group(1) if match else text
+
+
+def _remove_trailing_commas(text):
+    # String-aware so commas inside question text are left alone
+    out = []
+    in_string = escape = False
+    for i, char in enumerate(text):
+        if in_string:
+            if escape:
+                escape = False
+            elif char == "\\":
+                escape = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char == ",":
+            j = i + 1
+            while j < len(text) and text[j].isspace():
+                j += 1
+            if j < len(text) and text[j] in "}]":
+                continue
+        out.append(char)
+    return "".join(out)
+
+
+def _question_list(data):
+    if isinstance(data, list):
+        return data
+    if isinstance(data, dict):
+        for key in ("mcqs", "questions", "quiz"):
+            if isinstance(data.get(key), list):
+                return data[key]
+        if "options" in data:
+            return [data]
+    return []
+
+
+# Best-effort extraction of the raw question objects from a model response
+def tolerant_parse(text):
+    body = _remove_trailing_commas(strip_fences(text).strip())
+    start = min((i for i in (body.find("{"), body.find("[")) if i >= 0), default=-1)
+    if start < 0:
+        return []
+    body = body[start:]
+    try:
+        return _question_list(json.loads(body))
+    except json.JSONDecodeError:
+        pass
+    try:
+        return _question_list(json.JSONDecoder().raw_decode(body)[0])
+    except json.JSONDecodeError:
+        pass
+    # Truncated or otherwise broken: keep every question object that closed
+    return MCQStreamParser().feed(body)
+
+
+# Parse and validate a model response. Returns (valid MCQ dicts, number of
+# rejected questions); duplicates of an earlier question are dropped.
+def validate_response(text):
+    valid, rejected, seen = [], 0, set()
+    for data in tolerant_parse(text):
+        try:
+            question = MCQ.from_dict(data)
+        except InvalidMCQ:
+            rejected += 1
+            continue
+        if question.mcq.lower() in seen:
+            continue
+        seen.add(question.mcq.lower())
+        valid.append(question.to_dict())
+    return valid, rejected
+
+
+def validate_questions(questions):
+    valid = []
+    for data in questions:
+        try:
+            valid.append(MCQ.from_dict(data).to_dict())
+        except InvalidMCQ:
+            pass
+    return valid
+
+
+def _sample_response(picker, count):
+    mcqs = [{
+        "mcq": f"Question {n}, about topic {picker.randrange(1000)}?",
+        "options": {key: f"choice {key}{n}" for key in OPTION_KEYS},
+        "correct": picker.choice(OPTION_KEYS),
+    } for n in range(count)]
+    return {"mcqs": mcqs}
+
+
+def _corrupt(picker, response):
+    mcqs = response["mcqs"]
+    kind = picker.choice(["valid", "fence", "trailing_comma", "missing_correct", "three_options",
+                          "upper_correct", "answer_text", "letter_like_text", "options_list", "truncated",
+                          "prose"])
+    target = picker.randrange(len(mcqs))
+    if kind == "missing_correct":
+        mcqs[target]["correct"] = "e"
+    elif kind == "three_options":
+        del mcqs[target]["options"]["d"]
+    elif kind == "upper_correct":
+        mcqs[target]["correct"] = mcqs[target]["correct"].upper() + ")"
+    elif kind == "answer_text":
+        mcqs[target]["correct"] = mcqs[target]["options"][mcqs[target]["correct"]]
+    elif kind == "letter_like_text":
+        # Option texts that start like a decorated key, answered by text
+        mcqs[target]["options"] = {"a": "Paris", "b": "A city in Italy", "c": "D. H. Lawrence", "d": "C major"}
+        mcqs[target]["correct"] = mcqs[target]["options"][mcqs[target]["correct"]]
+    elif kind == "options_list":
+        mcqs[target]["options"] = list(mcqs[target]["options"].values())
+    text = json.dumps(response, indent=1)
+    if kind == "fence":
+        text = f"```json\n{text}\n```"
+    elif kind == "trailing_comma":
+        text = text.replace('"\n  }', '",\n  }').replace("}\n ]", "},\n ]")
+    elif kind == "truncated":
+        text = text[:picker.randrange(len(text) // 2, len(text))]
+    elif kind == "prose":
+        text = f"Here is your quiz:\n{text}\nGood luck!"
+    return kind, text
+
+
+def _naive_ok(text, count):
+    # What the app did before: json.loads, then index options by the answer key
+    try:
+        mcqs = json.loads(text).get("mcqs", [])
+        for question in mcqs:
+            question["options"][question["correct"]]
+        return len(mcqs) == count
+    except Exception:
+        return False
+
+
+# Fuzz benchmark: corrupt valid responses in the ways models actually fail and
+# count how many calls each strategy would make to end up with a full quiz.
+def benchmark(cases=2000, count=5, seed=0):
+    import random
+    import time
+
+    picker = random.Random(seed)
+    naive_regenerations = full_regenerations = top_ups = 0
+    salvaged = wrong_keys = 0
+    parse_seconds = 0.0
+    by_kind = {}
+    for _ in range(cases):
+        response = _sample_response(picker, count)
+        expected = {question["mcq"]: question["correct"] for question in response["mcqs"]}
+        kind, text = _corrupt(picker, response)
+        if not _naive_ok(text, count):
+            naive_regenerations += 1
+        start = time.perf_counter()
+        valid, _ = validate_response(text)
+        parse_seconds += time.perf_counter() - start
+        if not valid:
+            full_regenerations += 1
+        elif len(valid) < count:
+            top_ups += 1
+        salvaged += len(valid)
+        wrong_keys += sum(1 for question in valid if question["correct"] != expected[question["mcq"]])
+        by_kind.setdefault(kind, [0, 0])
+        by_kind[kind][0] += 1
+        by_kind[kind][1] += len(valid)
+    return {
+        "cases": cases,
+        "naive_regenerations": naive_regenerations,
+        "full_regenerations": full_regenerations,
+        "top_ups": top_ups,
+        "salvaged_questions": salvaged,
+        "wrong_keys": wrong_keys,
+        "parse_us": parse_seconds / cases * 1e6,
+        "by_kind": {kind: round(total / (n * count), 2) for kind, (n, total) in sorted(by_kind.items())},
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Fuzz the response validator with malformed model output")
+    parser.add_argument("--cases", type=int, default=2000)
+    args = parser.parse_args()
+    result = benchmark(args.cases)
+    print(f"cases={result['cases']} parse={result['parse_us']:.0f}us/response")
+    print(f"before: {result['naive_regenerations']} full regenerations")
+    print(f"after:  {result['full_regenerations']} full regenerations, "
+          f"{result['top_ups']} partial top-ups for the missing questions only")
+    print("share of questions salvaged by corruption:", result["by_kind"])
+    print(f"salvaged questions graded against the wrong key: {result['wrong_keys']}")